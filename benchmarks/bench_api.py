@@ -0,0 +1,62 @@
+"""
+Benchmark: the JSON API against the HTML index.
+Seeds a temporary database, then times fetching the same page of posts as
+HTML and as JSON (with and without the bodies), plus a big JSON listing,
+and reports requests per second and response size. Uses orjson when it
+is installed - run once with and once without it to compare.
+Run with flaskr installed (pip install -e .[json]):
+
+    python benchmarks/bench_api.py --posts 10000 --requests 500
+"""
+
+import argparse
+import time
+
+from flaskr import api, create_app
+
+from seed import seed, temp_database
+
+
+def measure(client, path, requests):
+    size = len(client.get(path).data)
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path)
+        response.data
+        assert response.status_code == 200
+    return requests / (time.perf_counter() - start), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    path, cleanup = temp_database()
+    try:
+        # Page and fragment caches off, so every request does all the work.
+        app = create_app({
+            'DATABASE': path, 'PAGE_CACHE_SIZE': 0, 'FRAGMENT_CACHE_SIZE': 0
+        })
+        seed(app, posts=args.posts)
+        client = app.test_client()
+        per_page = app.config['POSTS_PER_PAGE']
+
+        print(f"JSON serializer: {'orjson' if api.orjson else 'json'}")
+        print(f"{'path':<56}{'req/s':>10}{'bytes':>10}")
+        for path, requests in (
+            ('/', args.requests),
+            (f'/api/posts?limit={per_page}', args.requests),
+            (f'/api/posts?limit={per_page}&fields=id,title,created,username',
+             args.requests),
+            ('/api/posts?limit=1000', max(args.requests // 20, 1)),
+        ):
+            rate, size = measure(client, path, requests)
+            print(f'{path:<56}{rate:>10.1f}{size:>10}')
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark: index page query with and without the join to user.
+Seeds a temporary database (see seed.py), then times the first page and a
+deep page of the index query in both modes, and prints SQLite's plan for
+each. Run with flaskr installed (pip install -e .):
+
+    python benchmarks/bench_denormalized.py --posts 100000 --repeat 2000
+"""
+
+import argparse
+import time
+
+from flaskr import create_app
+from flaskr.db import get_db
+
+from seed import seed, temp_database
+
+QUERIES = {
+    'join': (
+        'SELECT p.id, title, body, created, author_id, u.username, revision'
+        ' FROM post p JOIN user u ON p.author_id = u.id'
+    ),
+    'denormalized': (
+        'SELECT p.id, title, body, created, author_id,'
+        ' p.author_username AS username, revision FROM post p'
+    ),
+}
+PAGE = (
+    ' WHERE (p.created, p.id) < (?, ?)'
+    ' ORDER BY p.created DESC, p.id DESC LIMIT ?'
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    path, cleanup = temp_database()
+    try:
+        app = create_app({'DATABASE': path, 'QUERY_STATS': False})
+        seed(app, args.users, args.posts)
+
+        with app.app_context():
+            db = get_db()
+            # First page, and a page half way through.
+            cursors = {
+                'first page': ('9999-12-31', 0),
+                'deep page': tuple(db.execute(
+                    'SELECT created, id FROM post WHERE id = ?',
+                    (args.posts // 2,)
+                ).fetchone()),
+            }
+            cursors = {
+                name: (str(created), id)
+                for name, (created, id) in cursors.items()
+            }
+
+            for name, sql in QUERIES.items():
+                plan = db.execute(
+                    'EXPLAIN QUERY PLAN ' + sql + PAGE,
+                    cursors['first page'] + (args.per_page,)
+                ).fetchall()
+                print(f'{name} plan:')
+                for step in plan:
+                    print(f'    {step[3]}')
+
+            for page, cursor in cursors.items():
+                for name, sql in QUERIES.items():
+                    params = cursor + (args.per_page,)
+                    start = time.perf_counter()
+                    for _ in range(args.repeat):
+                        db.execute(sql + PAGE, params).fetchall()
+                    elapsed = time.perf_counter() - start
+                    print(f'{page:>10} {name:>12}:'
+                          f' {elapsed / args.repeat * 1e6:8.1f} us/query')
+    finally:
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark: cold start with and without template preloading.
+Starts a fresh Python process per run, so nothing is cached in memory, and
+times importing flask and flaskr, create_app, and the first few requests
+to the index, login and register pages - the latency a new worker shows
+after a deploy. Compares compiling templates lazily (no preload, no
+bytecode cache) against preloading with an empty and with a filled
+bytecode cache, and times create_app for a process run by the flask
+command for a command such as init-db, which leaves out the views.
+Fails when that takes longer than --target milliseconds.
+Run with flaskr installed (pip install -e .):
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from flaskr import create_app
+
+from seed import seed, temp_database
+
+# Run in the child process. Prints the timings in ms as JSON.
+CHILD = """
+import json, os, sys, time
+config, command = json.loads(sys.argv[1]), sys.argv[2]
+if command:
+    # As if started by the flask command.
+    os.environ['FLASK_RUN_FROM_CLI'] = 'true'
+    sys.argv = ['flask', command]
+start = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+app = create_app(config)
+created = time.perf_counter()
+first = []
+if not command:
+    client = app.test_client()
+    for path in ('/', '/auth/login', '/auth/register'):
+        t = time.perf_counter()
+        assert client.get(path).status_code == 200
+        first.append(time.perf_counter() - t)
+print(json.dumps({
+    'import': (imported - start) * 1000,
+    'create_app': (created - imported) * 1000,
+    'first_requests': sum(first) * 1000,
+}))
+"""
+
+# Name -> (config, flask command or '' for a web worker).
+MODES = {
+    'lazy': ({'TEMPLATE_PRELOAD': False, 'TEMPLATE_CACHE_DIR': None}, ''),
+    'preload, cold cache': ({'TEMPLATE_PRELOAD': True}, ''),
+    'preload, warm cache': ({'TEMPLATE_PRELOAD': True}, ''),
+    'flask init-db': ({}, 'init-db'),
+}
+COMMAND_MODE = 'flask init-db'
+
+
+def run_child(config, command):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, json.dumps(config), command],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--target', type=float, default=20.0,
+                        help='most ms create_app may take for a command')
+    args = parser.parse_args()
+
+    path, cleanup = temp_database()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        seed(create_app({'DATABASE': path}), users=10, posts=100)
+        print(f"{'mode':<22}{'import ms':>11}{'create_app ms':>15}"
+              f"{'first requests ms':>20}{'total ms':>10}")
+        medians = {}
+        for name, (mode, command) in MODES.items():
+            config = dict({'DATABASE': path,
+                           'TEMPLATE_CACHE_DIR': cache_dir}, **mode)
+            results = []
+            for _ in range(args.runs):
+                # The cold cache mode starts from an empty directory.
+                if name == 'preload, cold cache':
+                    shutil.rmtree(cache_dir)
+                results.append(run_child(config, command))
+
+            imported = statistics.median(r['import'] for r in results)
+            created = statistics.median(r['create_app'] for r in results)
+            first = statistics.median(r['first_requests'] for r in results)
+            medians[name] = created
+            print(f'{name:<22}{imported:>11.1f}{created:>15.1f}{first:>20.1f}'
+                  f'{imported + created + first:>10.1f}')
+
+        created = medians[COMMAND_MODE]
+        print(f'{COMMAND_MODE} create_app: {created:.1f}ms,'
+              f' target {args.target:.1f}ms')
+        if created > args.target:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark: group commit.
+Seeds a temporary database, then has --threads logged-in clients create
+posts at the same time, with each write committing on its own and then
+through the group-commit writer, and reports posts per second. Run once
+with --synchronous FULL to see the gain when every commit is an fsync.
+Run with flaskr installed (pip install -e .):
+
+    python benchmarks/bench_writes.py --threads 16 --posts 200
+"""
+
+import argparse
+import threading
+import time
+
+from flaskr import create_app
+from flaskr.db import get_writer
+
+from seed import PASSWORD, seed, temp_database
+
+
+def measure(app, threads, posts):
+    clients = []
+    for n in range(threads):
+        client = app.test_client()
+        client.post(
+            '/auth/login', data={'username': f'user{n}', 'password': PASSWORD}
+        )
+        clients.append(client)
+
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(client):
+        barrier.wait()
+        for n in range(posts):
+            response = client.post(
+                '/create', data={'title': f'bench {n}', 'body': 'body'}
+            )
+            assert response.status_code == 302
+
+    workers = [
+        threading.Thread(target=worker, args=(client,)) for client in clients
+    ]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return threads * posts / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--synchronous', default='NORMAL')
+    args = parser.parse_args()
+
+    print(f'synchronous={args.synchronous}, {args.threads} threads')
+    for group in (False, True):
+        path, cleanup = temp_database()
+        try:
+            app = create_app({'DATABASE': path, 'RATE_LIMITS': {}})
+            app.config['DATABASE_PRAGMAS']['synchronous'] = args.synchronous
+            app.config['GROUP_COMMIT'] = group
+            seed(app, users=args.threads, posts=1000)
+            rate = measure(app, args.threads, args.posts)
+            line = f"group commit {'on ' if group else 'off'}:" \
+                f' {rate:8.1f} posts/s'
+            if group:
+                stats = get_writer(app).stats()
+                line += f" ({stats['writes'] / max(stats['batches'], 1):.1f}" \
+                    ' writes per commit)'
+                get_writer(app).close()
+            print(line)
+        finally:
+            cleanup()
+
+
+if __name__ == '__main__':
+    main()
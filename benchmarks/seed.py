@@ -0,0 +1,81 @@
+"""
+Seed a database with generated users and posts for the benchmarks.
+Far more data than tests/data.sql, inserted in batches with executemany.
+Every user has the password 'bench' and is called user<n>; posts are
+spread round-robin over the users, one minute apart.
+
+    python benchmarks/seed.py instance/flaskr.sqlite --users 1000 --posts 100000
+"""
+
+import argparse
+import itertools
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from flaskr import create_app
+from flaskr.db import get_db, init_db
+from flaskr.hashing import get_hasher
+
+PASSWORD = 'bench'
+BATCH_SIZE = 5000
+
+
+# Wipe the app's database and fill it with `users` users and `posts` posts.
+def seed(app, users=100, posts=10000):
+    with app.app_context():
+        init_db()
+        db = get_db()
+
+        # Hashing is slow on purpose - one hash serves every user.
+        pwhash = get_hasher().hash(PASSWORD)
+        db.executemany(
+            'INSERT INTO user (username, password) VALUES (?, ?)',
+            ((f'user{n}', pwhash) for n in range(users))
+        )
+
+        start = datetime(2020, 1, 1)
+        rows = (
+            (f'post {n}', f'body of post {n} ' * 10, n % users + 1,
+             start + timedelta(minutes=n))
+            for n in range(posts)
+        )
+        while True:
+            batch = list(itertools.islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            db.executemany(
+                'INSERT INTO post (title, body, author_id, created)'
+                ' VALUES (?, ?, ?, ?)',
+                batch
+            )
+        db.commit()
+
+
+# Temporary database file for a benchmark run. Returns the path and a
+# function that removes it (and its WAL files) again.
+def temp_database():
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+
+    def cleanup():
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+    return path, cleanup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('database')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=10000)
+    args = parser.parse_args()
+
+    seed(create_app({'DATABASE': args.database}), args.users, args.posts)
+    print(f'Seeded {args.users} users and {args.posts} posts.')
+
+
+if __name__ == '__main__':
+    main()
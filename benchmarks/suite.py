@@ -0,0 +1,303 @@
+"""
+Latency and throughput benchmark for every route.
+Seeds a temporary database (see seed.py), then drives the index, search,
+create, update, delete, login and register routes through the Flask test
+client and through a real threaded WSGI server, and reports requests per
+second and p50/p95/p99 latency per route.
+Run with flaskr installed (pip install -e .):
+
+    python benchmarks/suite.py                   # run and print
+    python benchmarks/suite.py --save            # store as the baseline
+    python benchmarks/suite.py --compare         # fail on regressions
+
+The baseline lives in benchmarks/baseline.json. Numbers depend on the
+machine, so save a new baseline when moving to different hardware.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from flaskr import create_app
+
+from seed import PASSWORD, seed, temp_database
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# Statuses a route may answer with - the write routes redirect.
+OK = (200, 302)
+
+
+# Adapter so the scenarios can use the test client and a real server alike.
+# Both return the response status code.
+class TestClient(object):
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def get(self, path):
+        return self._client.get(path).status_code
+
+    def post(self, path, data=None):
+        return self._client.post(path, data=data or {}).status_code
+
+
+# Minimal HTTP client with a cookie jar, one connection per request like
+# a browser without keep-alive. Does not follow redirects.
+class HttpClient(object):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def _request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                f'{name}={value}' for name, value in self.cookies.items()
+            )
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        conn = http.client.HTTPConnection(self.host, self.port)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+        finally:
+            conn.close()
+
+        for cookie in response.headers.get_all('Set-Cookie') or ():
+            name, _, rest = cookie.partition('=')
+            self.cookies[name] = rest.split(';', 1)[0]
+        return response.status
+
+    def get(self, path):
+        return self._request('GET', path)
+
+    def post(self, path, data=None):
+        return self._request('POST', path, data or {})
+
+
+# Request handler for the real server that does not log every request.
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+# The routes to time. Each scenario is (needs login, request function); the
+# request function gets a client and the request number.
+# Seeded posts are spread round-robin over the users, so user0 (id 1) owns
+# posts 1, users + 1, 2 * users + 1, ... - update works on those. Delete
+# removes the posts the create scenario added, ids posts + 1 onwards.
+def make_scenarios(users, posts):
+    own_posts = list(range(1, posts + 1, users))
+    to_delete = itertools.count(posts + 1)
+    lock = threading.Lock()
+    registered = itertools.count()
+
+    # Cursor for a page half way through the posts.
+    middle = posts // 2
+    created = datetime(2020, 1, 1) + timedelta(minutes=middle - 1)
+    deep_page = '/?' + urlencode({'before': f'{created}~{middle}'})
+
+    def delete(client, n):
+        with lock:
+            id = next(to_delete)
+        return client.post(f'/{id}/delete')
+
+    def register(client, n):
+        name = f'new{next(registered)}'
+        return client.post(
+            '/auth/register', {'username': name, 'password': PASSWORD}
+        )
+
+    return {
+        'index': (False, lambda client, n: client.get('/')),
+        'index_deep_page': (False, lambda client, n: client.get(deep_page)),
+        'search': (False, lambda client, n: client.get('/search?q=post')),
+        'index_logged_in': (True, lambda client, n: client.get('/')),
+        'create': (True, lambda client, n: client.post(
+            '/create', {'title': f'new {n}', 'body': 'benchmark'}
+        )),
+        'update': (True, lambda client, n: client.post(
+            f'/{own_posts[n % len(own_posts)]}/update',
+            {'title': f'updated {n}', 'body': 'benchmark'}
+        )),
+        'delete': (True, delete),
+        'login': (False, lambda client, n: client.post(
+            '/auth/login', {'username': 'user0', 'password': PASSWORD}
+        )),
+        'register': (False, register),
+    }
+
+
+# Run one scenario `requests` times spread over `concurrency` threads, each
+# with its own client. Returns throughput and latency percentiles (ms).
+def measure(make_client, scenario, requests, concurrency):
+    needs_login, call = scenario
+    counter = itertools.count()
+    latencies = []
+
+    # Set up and log in the clients before the clock starts.
+    clients = [make_client() for _ in range(concurrency)]
+    if needs_login:
+        for client in clients:
+            client.post(
+                '/auth/login', {'username': 'user0', 'password': PASSWORD}
+            )
+
+    def worker(client, count):
+        for _ in range(count):
+            n = next(counter)
+            start = time.perf_counter()
+            status = call(client, n)
+            latencies.append(time.perf_counter() - start)
+            if status not in OK:
+                raise RuntimeError(f'Request {n} answered {status}.')
+
+    counts = [requests // concurrency] * concurrency
+    counts[0] += requests % concurrency
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, clients, counts))
+    elapsed = time.perf_counter() - start
+
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50': round(cuts[49] * 1000, 2),
+        'p95': round(cuts[94] * 1000, 2),
+        'p99': round(cuts[98] * 1000, 2),
+    }
+
+
+# Run every scenario against a fresh database for one transport.
+def run(transport, args):
+    path, cleanup = temp_database()
+    try:
+        # Every client shares one address, so the auth limits are off.
+        app = create_app({'DATABASE': path, 'RATE_LIMITS': {}})
+        seed(app, args.users, args.posts)
+        scenarios = make_scenarios(args.users, args.posts)
+
+        server = None
+        if transport == 'wsgi':
+            server = make_server(
+                '127.0.0.1', 0, app, threaded=True,
+                request_handler=QuietHandler
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+            def make_client():
+                return HttpClient('127.0.0.1', server.server_port)
+        else:
+            def make_client():
+                return TestClient(app)
+
+        results = {}
+        try:
+            for name, scenario in scenarios.items():
+                # Hashing makes the auth routes slow on purpose.
+                if name in ('login', 'register'):
+                    requests = args.auth_requests
+                else:
+                    requests = args.requests
+                results[name] = measure(
+                    make_client, scenario, requests, args.concurrency
+                )
+        finally:
+            if server is not None:
+                server.shutdown()
+        return results
+    finally:
+        cleanup()
+
+
+# Compare results against the baseline. A route regresses when its p95
+# latency grows, or its throughput drops, by more than the tolerance.
+def compare(results, baseline, tolerance):
+    regressions = []
+    for transport, routes in results.items():
+        for name, result in routes.items():
+            base = baseline.get(transport, {}).get(name)
+            if base is None:
+                continue
+            if result['p95'] > base['p95'] * (1 + tolerance):
+                regressions.append(
+                    f"{transport} {name}: p95 {result['p95']}ms,"
+                    f" baseline {base['p95']}ms"
+                )
+            if result['rps'] < base['rps'] * (1 - tolerance):
+                regressions.append(
+                    f"{transport} {name}: {result['rps']} req/s,"
+                    f" baseline {base['rps']} req/s"
+                )
+    return regressions
+
+
+def report(results):
+    print(f"{'route':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}")
+    for transport, routes in results.items():
+        print(f'[{transport}]')
+        for name, result in routes.items():
+            print(f"{name:<24}{result['rps']:>10}{result['p50']:>10}"
+                  f"{result['p95']:>10}{result['p99']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route')
+    parser.add_argument('--auth-requests', type=int, default=10,
+                        help='requests for login and register')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--transport', choices=('test', 'wsgi'),
+                        action='append',
+                        help='test client, real server, or both (default)')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='exit with status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {}
+    for transport in args.transport or ('test', 'wsgi'):
+        results[transport] = run(transport, args)
+    report(results)
+
+    if args.save:
+        with open(BASELINE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Saved baseline to {BASELINE}.')
+
+    if args.compare:
+        with open(BASELINE) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against the baseline.')
+
+
+if __name__ == '__main__':
+    main()
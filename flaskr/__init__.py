@@ -7,8 +7,15 @@ https://flask.palletsprojects.com/en/2.0.x/tutorial/factory/
 import os
 from flask import Flask
 
+from flaskr.startup import (
+    StartupProfile, cli_only, format_profile, startup_profile_command
+)
+
 # Factory function.
 def create_app(test_config=None):
+    # Startup is timed per component, see startup.py.
+    profile = StartupProfile()
+
     # Create Flask instance - files relative to instance folder.
     # Outside flaskr/ folder.
     app = Flask(__name__, instance_relative_config=True)
@@ -18,7 +25,132 @@ def create_app(test_config=None):
         # Override with random value before deployment.
         SECRET_KEY='dev',
         # Choose the database file/location.
-        DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite')
+        DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        # Connections kept open per process, and how long a request waits
+        # for one when they are all busy. A size of 0 turns pooling off.
+        DATABASE_POOL_SIZE=5,
+        DATABASE_POOL_TIMEOUT=10.0,
+        # Funnel writes through one thread that commits those arriving
+        # within GROUP_COMMIT_WINDOW_MS of each other together, at most
+        # GROUP_COMMIT_MAX_BATCH at a time (see writer.py).
+        GROUP_COMMIT=False,
+        GROUP_COMMIT_WINDOW_MS=2,
+        GROUP_COMMIT_MAX_BATCH=64,
+        # Read-only copies of DATABASE, refreshed every REPLICA_SYNC_INTERVAL
+        # seconds (None: only on writes, with REPLICA_SYNC_ON_WRITE, or by
+        # `flask sync-replicas`) by whichever worker gets there first. The
+        # index, search and the logged in user are read from them. Empty
+        # turns replicas off.
+        DATABASE_REPLICAS=(),
+        REPLICA_SYNC_INTERVAL=5.0,
+        REPLICA_SYNC_ON_WRITE=False,
+        # Pragmas run on every new connection. WAL lets readers carry on
+        # while a post is being written, and busy_timeout (ms) makes writers
+        # wait for the lock instead of failing with "database is locked".
+        DATABASE_PRAGMAS={
+            'busy_timeout': 5000,
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            # Negative means KiB, so about 16MB of page cache.
+            'cache_size': -16000,
+            'mmap_size': 128 * 1024 * 1024,
+            'temp_store': 'MEMORY',
+        },
+        # Password hashing: werkzeug method with its cost, worker processes
+        # (0 hashes on the request thread) and how many hashes may run or
+        # wait at once before requests are turned away with 503.
+        # Changing the method rehashes each password at its next login.
+        PASSWORD_HASH_METHOD='pbkdf2:sha256:260000',
+        PASSWORD_HASH_WORKERS=2,
+        PASSWORD_HASH_QUEUE=16,
+        # Token bucket limits on the auth form posts, as (burst, seconds to
+        # refill it), or None for no limit. Over the limit gets 429 before
+        # any query or password hash. Buckets are kept per process
+        # ('memory', at most RATELIMIT_SIZE) or in RATELIMIT_DATABASE
+        # ('sqlite'), shared by the workers, and swept of buckets that are
+        # full again every RATELIMIT_SWEEP_INTERVAL seconds. See ratelimit.py.
+        RATE_LIMITS={
+            'login_ip': (20, 60),
+            'login_user': (5, 60),
+            'register_ip': (5, 600),
+        },
+        RATELIMIT_STORAGE='memory',
+        RATELIMIT_SIZE=10000,
+        RATELIMIT_DATABASE=os.path.join(app.instance_path, 'ratelimit.sqlite'),
+        RATELIMIT_SWEEP_INTERVAL=300,
+        # Where sessions are kept: in Flask's signed cookie ('cookie'), or on
+        # the server with only a random id in the cookie - in this process
+        # ('memory', at most SESSION_SIZE) or in SESSION_DATABASE ('sqlite'),
+        # shared by the workers. Expired sessions are deleted every
+        # SESSION_SWEEP_INTERVAL seconds (None: never). See sessions.py.
+        SESSION_STORAGE='cookie',
+        SESSION_SIZE=10000,
+        SESSION_DATABASE=os.path.join(app.instance_path, 'sessions.sqlite'),
+        SESSION_SWEEP_INTERVAL=300,
+        # Per-statement query timing (see querylog.py). Statements taking
+        # SLOW_QUERY_MS or longer go to the SLOW_QUERY_LOG file (None turns
+        # it off), and each worker saves its totals to QUERY_STATS_DIR every
+        # QUERY_STATS_FLUSH seconds for `flask query-stats`.
+        QUERY_STATS=True,
+        SLOW_QUERY_MS=100,
+        SLOW_QUERY_LOG=os.path.join(app.instance_path, 'slow_queries.log'),
+        QUERY_STATS_DIR=os.path.join(app.instance_path, 'query_stats'),
+        QUERY_STATS_FLUSH=10,
+        # Serve request, DB and template timings from /metrics.
+        METRICS_ENABLED=True,
+        # Logged in users cached per process, and for how many seconds.
+        # The TTL bounds how long other workers can serve a stale row.
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=60,
+        # Rendered post <article>s, kept until evicted or the post changes.
+        FRAGMENT_CACHE_SIZE=4096,
+        FRAGMENT_CACHE_TTL=None,
+        # Whole index pages for logged out visitors. Writes clear this cache
+        # in the worker that made them, the TTL covers the other workers.
+        PAGE_CACHE_SIZE=256,
+        PAGE_CACHE_TTL=5,
+        # Single post pages for logged out visitors, checked against the
+        # post's revision on every hit, and how long browsers and proxies
+        # may keep them (seconds) without asking again.
+        POST_CACHE_SIZE=1024,
+        POST_CACHE_TTL=None,
+        POST_MAX_AGE=3600,
+        # Read the author's username from the post row instead of joining
+        # with user. Needs post.author_username - run
+        # `flask denormalize-authors` on databases older than that column.
+        DENORMALIZED_AUTHOR=False,
+        # Compiled templates are cached in TEMPLATE_CACHE_DIR, shared by all
+        # workers (None turns it off), and every template is loaded when the
+        # app is created (see templating.py). Templates are only checked for
+        # changes if TEMPLATES_AUTO_RELOAD is set, or in debug mode when it
+        # is None - never in production.
+        TEMPLATE_CACHE_DIR=os.path.join(app.instance_path, 'jinja_cache'),
+        TEMPLATE_PRELOAD=True,
+        TEMPLATES_AUTO_RELOAD=None,
+        # HTML, JSON, CSS and JS responses of at least COMPRESS_MIN_SIZE
+        # bytes are sent gzip (or brotli) compressed, see compress.py.
+        COMPRESS_MIMETYPES=(
+            'text/html', 'application/json', 'text/css',
+            'application/javascript', 'text/plain',
+        ),
+        COMPRESS_MIN_SIZE=500,
+        COMPRESS_LEVEL=6,
+        # How long browsers keep static files fingerprinted by
+        # `flask build-static` (see assets.py) - they never change.
+        STATIC_MAX_AGE=365 * 24 * 3600,
+        # Log how long each part of create_app took (see startup.py).
+        STARTUP_PROFILE=False,
+        # Load the views under the flask command even for commands that
+        # serve no pages, such as init-db.
+        CLI_LOAD_VIEWS=False,
+        # Number of posts shown on each page of the blog index.
+        POSTS_PER_PAGE=20,
+        # Number of results on each page of the search view.
+        SEARCH_RESULTS_PER_PAGE=10,
+        # Posts per page of /api/posts by default, and the most a client
+        # may ask for with ?limit=.
+        API_PAGE_SIZE=100,
+        API_MAX_PAGE_SIZE=1000,
     )
 
     if test_config is None:
@@ -32,34 +164,119 @@ def create_app(test_config=None):
 
     # Ensure the instance folder exists.
     # Not done automatically by Flask - needed for SQLite database.
-    try:
-        os.makedirs(app.instance_path)
-    except OSError:
-        pass
+    os.makedirs(app.instance_path, exist_ok=True)
+
+    # Processes that only run a flask command skip everything marked web
+    # below - the views, their hooks and the template preloading.
+    web = app.config['CLI_LOAD_VIEWS'] or not cli_only()
+
+    # Template bytecode cache - set up before anything renders.
+    with profile.step('templating'):
+        from . import templating
+        templating.init_app(app)
+
+    if web:
+        # Create a simple route to see application function.
+        @app.route('/hello')
+        def hello():
+            return 'Hello, World!'
 
-    # Create a simple route to see application function.
-    @app.route('/hello')
-    def hello():
-        return 'Hello, World!'
+        # Compressed responses. First, so it runs after the other
+        # after_request hooks and compresses their final result.
+        with profile.step('compress'):
+            from . import compress
+            compress.init_app(app)
+
+    # Fingerprinted, pre-compressed static files.
+    with profile.step('assets'):
+        from . import assets
+        assets.init_app(app)
 
     # Import and call the functions in db.py in this factory.
-    from . import db
-    # Pass the app to the database to register the other functions.
-    db.init_app(app)
-
-    # Import the auth blueprint to register it with the app.
-    from . import auth
-    # Pass in the blueprint to the app.
-    app.register_blueprint(auth.bp)
-
-    # Import the blog blueprint to register it with the app.
-    from . import blog
-    app.register_blueprint(blog.bp)
-    # Unlike auth there is no url_prefix for blog. The index view will be at /,
-    # the create at create/, etc. The blog is the main feature of this tutorial
-    # so it is the main index.
-    app.add_url_rule('/', endpoint='index')
-    # add_url_rule associates the endpoint name 'index' with '/', so
-    # url_for('index') or url_for('blog.index') both work - generating '/'.
+    with profile.step('db'):
+        from . import db
+        # Pass the app to the database to register the other functions.
+        db.init_app(app)
+
+    if web:
+        # Load balancer health check - answers without touching templates
+        # or the session.
+        @app.route('/healthz')
+        def healthz():
+            db.get_db().execute('SELECT 1')
+            return 'ok'
+
+    # Bulk import/export commands for users and posts.
+    with profile.step('bulk'):
+        from . import bulk
+        bulk.init_app(app)
+
+    # Query and render timing for every request.
+    with profile.step('querylog'):
+        from . import querylog
+        querylog.init_app(app)
+
+    if web:
+        # Prometheus metrics endpoint at /metrics.
+        if app.config['METRICS_ENABLED']:
+            with profile.step('metrics'):
+                from . import metrics
+                metrics.init_app(app)
+
+        # Rate limits on login and register, checked before the auth hooks.
+        with profile.step('ratelimit'):
+            from . import ratelimit
+            ratelimit.init_app(app)
+
+        # Cookie or server-side sessions.
+        with profile.step('sessions'):
+            from . import sessions
+            sessions.init_app(app)
+
+        # Import the auth blueprint to register it with the app.
+        with profile.step('auth'):
+            from . import auth
+            # Pass in the blueprint to the app.
+            app.register_blueprint(auth.bp)
+
+        # Import the blog blueprint to register it with the app.
+        with profile.step('blog'):
+            from . import blog
+            app.register_blueprint(blog.bp)
+            # Unlike auth there is no url_prefix for blog. The index view will be at /,
+            # the create at create/, etc. The blog is the main feature of this tutorial
+            # so it is the main index.
+            app.add_url_rule('/', endpoint='index')
+            # add_url_rule associates the endpoint name 'index' with '/', so
+            # url_for('index') or url_for('blog.index') both work - generating '/'.
+
+        # JSON API for posts at /api.
+        with profile.step('api'):
+            from . import api
+            app.register_blueprint(api.bp)
+
+    # Compile and load every template now instead of on first use, and
+    # record how long startup took (also served from /metrics).
+    count, template_seconds = 0, 0.0
+    if web:
+        with profile.step('templates'):
+            count, template_seconds = templating.warm(app)
+    app.cli.add_command(startup_profile_command)
+    app.extensions['startup'] = {
+        'seconds': profile.elapsed(),
+        'started_at': profile.started_at,
+        'templates': count,
+        'template_seconds': template_seconds,
+        'components': profile.components,
+        'cli_only': not web,
+    }
+    app.logger.info(
+        'Started in %.1fms, %d templates loaded in %.1fms.',
+        app.extensions['startup']['seconds'] * 1000, count,
+        template_seconds * 1000
+    )
+    if app.config['STARTUP_PROFILE']:
+        for line in format_profile(app.extensions['startup']):
+            app.logger.info(line)
 
     return app
@@ -0,0 +1,215 @@
+"""
+JSON API for posts.
+
+    GET    /api/posts              newest first, ?before=<cursor>&limit=N
+    GET    /api/posts/<id>
+    POST   /api/posts              {"title": ..., "body": ...}
+    PUT    /api/posts/<id>
+    DELETE /api/posts/<id>
+
+?fields=id,title picks the fields returned (and read from SQLite), for
+example to list posts without their bodies. Lists are streamed: each row
+is serialized as it comes off the SQLite cursor, so even a page of
+thousands of posts never sits in memory whole. The list ends with a "next"
+cursor for the following page, null on the last one.
+
+Writes use the same session login as the HTML pages and take a JSON body
+only - browsers cannot send that cross-site without asking first, which
+keeps forms on other sites from posting here. orjson is used when
+installed (pip install flaskr[json]), the standard json module otherwise.
+"""
+
+import functools
+
+from flask import (
+    Blueprint, current_app, g, request, stream_with_context, url_for
+)
+from werkzeug.exceptions import HTTPException, abort
+
+from flaskr.blog import (
+    author_join, create_post, delete_post, get_post, make_cursor,
+    parse_cursor, update_post
+)
+from flaskr.db import get_read_db
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+# Fields a post can be returned with, and the column each is read from.
+# username comes from author_join.
+FIELDS = ('id', 'title', 'body', 'created', 'author_id', 'username',
+          'revision')
+COLUMNS = {
+    'id': 'p.id', 'title': 'p.title', 'body': 'p.body',
+    'created': 'p.created', 'author_id': 'p.author_id',
+    'revision': 'p.revision',
+}
+
+
+# Serialize to UTF-8 JSON bytes. Dates come out as ISO 8601 either way.
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    def _default(obj):
+        return obj.isoformat()
+
+    def dumps(obj):
+        return json.dumps(
+            obj, default=_default, separators=(',', ':'), ensure_ascii=False
+        ).encode('utf-8')
+
+def json_response(obj, status=200, headers=None):
+    return current_app.response_class(
+        dumps(obj), status=status, headers=headers,
+        mimetype='application/json'
+    )
+
+
+# Errors are JSON too - {"error": "Post id 5 doesn't exist."}.
+@bp.errorhandler(HTTPException)
+def handle_error(e):
+    response = json_response({'error': e.description}, e.code)
+    # Keep Retry-After, Allow, ... from the exception's own response.
+    for name, value in e.get_headers():
+        if name.lower() != 'content-type':
+            response.headers[name] = value
+    return response
+
+# Like auth.login_required, but a missing login is a 401 rather than a
+# redirect to the login page.
+def api_login_required(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        if g.user is None:
+            abort(401, 'Log in first.')
+        return view(**kwargs)
+    return wrapped_view
+
+
+# The fields asked for with ?fields=, all of them by default.
+def requested_fields():
+    value = request.args.get('fields')
+    if not value:
+        return FIELDS
+    fields = tuple(name.strip() for name in value.split(','))
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        abort(400, f"Unknown fields {', '.join(sorted(unknown))}.")
+    return fields
+
+def select_list(fields):
+    username, join = author_join()
+    columns = [
+        f'{COLUMNS[name]} AS {name}' if name != 'username' else username
+        for name in fields
+    ]
+    # The user table is only joined when the username is asked for.
+    return ', '.join(columns), join if 'username' in fields else ''
+
+def post_dict(post, fields):
+    return {name: post[name] for name in fields}
+
+
+# Stream one page of posts, newest first.
+# The query reads the requested fields plus created and id for the cursor,
+# and one row more than the page to find out if there is a next one.
+@bp.route('/posts')
+def list_posts():
+    fields = requested_fields()
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'],
+                             type=int)
+    if not 0 < limit <= current_app.config['API_MAX_PAGE_SIZE']:
+        abort(400, f"limit must be between 1 and"
+                   f" {current_app.config['API_MAX_PAGE_SIZE']}.")
+
+    columns, join = select_list(fields)
+    query = (
+        f'SELECT {columns}, p.created AS _created, p.id AS _id'
+        f' FROM post p{join}'
+    )
+    params = ()
+    before = request.args.get('before')
+    if before:
+        query += ' WHERE (p.created, p.id) < (?, ?)'
+        params = parse_cursor(before)
+    query += ' ORDER BY p.created DESC, p.id DESC LIMIT ?'
+    cursor = get_read_db().execute(query, params + (limit + 1,))
+
+    def generate():
+        yield b'{"posts":['
+        last = None
+        for n, post in enumerate(cursor):
+            if n == limit:
+                break
+            if last is not None:
+                yield b','
+            yield dumps(post_dict(post, fields))
+            last = post
+        else:
+            # No row past the page - this was the last one.
+            last = None
+        next_cursor = None
+        if last is not None:
+            next_cursor = make_cursor({
+                'created': last['_created'], 'id': last['_id']
+            })
+        yield b'],"next":' + dumps(next_cursor) + b'}'
+
+    # The app context, and with it the connection, stays open until the
+    # last chunk is sent.
+    return current_app.response_class(
+        stream_with_context(generate()), mimetype='application/json'
+    )
+
+@bp.route('/posts/<int:id>')
+def get(id):
+    return json_response(
+        post_dict(get_post(id, check_author=False), requested_fields())
+    )
+
+
+# Title and body from the JSON request body, or a 400.
+def read_post():
+    if not request.is_json:
+        abort(415, 'Send the post as application/json.')
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, 'The request body must be a JSON object.')
+    title = data.get('title')
+    body = data.get('body', '')
+    if not title or not isinstance(title, str):
+        abort(400, 'Title is required.')
+    if not isinstance(body, str):
+        abort(400, 'Body must be a string.')
+    return title, body
+
+@bp.route('/posts', methods=('POST',))
+@api_login_required
+def create():
+    title, body = read_post()
+    id = create_post(title, body)
+    return json_response(
+        post_dict(get_post(id), FIELDS), 201,
+        {'Location': url_for('api.get', id=id)}
+    )
+
+@bp.route('/posts/<int:id>', methods=('PUT',))
+@api_login_required
+def update(id):
+    get_post(id)
+    title, body = read_post()
+    update_post(id, title, body)
+    return json_response(post_dict(get_post(id), FIELDS))
+
+@bp.route('/posts/<int:id>', methods=('DELETE',))
+@api_login_required
+def delete(id):
+    get_post(id)
+    delete_post(id)
+    return '', 204
@@ -0,0 +1,154 @@
+"""
+Fingerprinted, pre-compressed static files.
+`flask build-static` copies every file in flaskr/static into static/dist
+under a name containing a hash of its contents (style.css becomes
+dist/style.3f2a9c1b7e4d.css), with gzip and, if brotli is installed,
+brotli versions next to it, and writes a manifest of the new names.
+
+With a manifest, url_for('static', filename='style.css') gives the
+fingerprinted URL. A changed file gets a new URL, so fingerprinted files
+are sent with a one-year immutable Cache-Control and browsers never ask
+for them again - and they are compressed once at build time, at the
+highest level, rather than on every request. Without a build, static
+files are served as before. Rebuild and restart when a file changes.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+import click
+from flask import current_app, send_from_directory
+from flask.cli import with_appcontext
+
+from flaskr.compress import brotli, choose_encoding
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+# File suffix of each encoding.
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    # mtime=0 so the same file always builds to the same bytes.
+    return gzip.compress(data, 9, mtime=0)
+
+
+# Fingerprint and compress every file in static_folder into static/dist.
+# Returns the manifest: original name -> fingerprinted name and the
+# encodings it is available in. Old builds are left in place, so pages
+# still being served by workers that have not restarted keep working.
+def build(static_folder):
+    dist = os.path.join(static_folder, DIST)
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder and DIST in dirs:
+            dirs.remove(DIST)
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(
+                os.sep, '/'
+            )
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            base, ext = os.path.splitext(filename)
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            built = f'{DIST}/{base}.{digest}{ext}'
+            target = os.path.join(static_folder, *built.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+
+            # Only keep the encodings that actually save something.
+            available = []
+            for encoding in encodings:
+                compressed = compress(data, encoding)
+                if len(compressed) < len(data):
+                    with open(target + SUFFIXES[encoding], 'wb') as f:
+                        f.write(compressed)
+                    available.append(encoding)
+
+            manifest[filename] = {'path': built, 'encodings': available}
+
+    os.makedirs(dist, exist_ok=True)
+    path = os.path.join(dist, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+# Read the manifest of the last build, empty if there is none.
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# url_for('static', filename=...) gives the fingerprinted name.
+def fingerprint_url(endpoint, values):
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    entry = current_app.extensions['static_manifest'].get(values['filename'])
+    if entry is not None:
+        values['filename'] = entry['path']
+
+
+# Replaces Flask's static view. Fingerprinted files are sent pre-compressed
+# when the client accepts it, and cached for good.
+def make_static_view(app, default_view):
+    manifest = app.extensions['static_manifest']
+    built = {entry['path']: entry['encodings'] for entry in manifest.values()}
+
+    def static(filename):
+        encodings = built.get(filename)
+        if encodings is None:
+            return default_view(filename=filename)
+
+        encoding = choose_encoding(encodings)
+        if encoding is None:
+            response = send_from_directory(app.static_folder, filename)
+        else:
+            response = send_from_directory(
+                app.static_folder, filename + SUFFIXES[encoding],
+                mimetype=mimetypes.guess_type(filename)[0]
+                or 'application/octet-stream'
+            )
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['STATIC_MAX_AGE']
+        response.cache_control.immutable = True
+        return response
+
+    return static
+
+
+@click.command('build-static')
+@with_appcontext
+def build_static_command():
+    """Fingerprint and pre-compress the static files."""
+    manifest = build(current_app.static_folder)
+    for filename, entry in sorted(manifest.items()):
+        encodings = ', '.join(entry['encodings']) or 'uncompressed'
+        click.echo(f"{filename} -> {entry['path']} ({encodings})")
+    click.echo(f'Built {len(manifest)} static files. Restart to use them.')
+
+
+def init_app(app):
+    app.extensions['static_manifest'] = load_manifest(app.static_folder)
+    if app.extensions['static_manifest']:
+        app.url_defaults(fingerprint_url)
+        app.view_functions['static'] = make_static_view(
+            app, app.view_functions['static']
+        )
+    app.cli.add_command(build_static_command)
@@ -7,14 +7,19 @@ TUTORIAL: blueprint for authentification, second one for blog posts.
 """
 
 import functools
+import sqlite3
+import time
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, redirect, render_template, request,
+    session, url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
 
-# Our function.
-from flaskr.db import get_db
+# Our functions.
+from flaskr.cache import get_cache
+from flaskr.db import get_db, get_read_db, mark_written, write
+from flaskr.hashing import get_hasher
+from flaskr.sessions import ServerSession
 
 
 # Create a blueprint class.
@@ -33,8 +38,6 @@ def register():
         # request.form special kind of dict, mapping sumbitted form k and vs.
         username = request.form['username']
         password = request.form['password']
-        # Request connection to the database.
-        db = get_db()
         error = None
 
         if not username:
@@ -43,20 +46,22 @@ def register():
             error = 'Password is required.'
 
         if error is None:
+            # We save the password as a hash for security.
+            # The hash is computed in a worker process, see hashing.py.
+            password_hash = get_hasher().hash(password)
             try:
                 # Create SQL query - (?) replaced by inputs.
                 # The database library will take care of escaping the values
                 # so you are not vulnerable to a SQL injection attack.
-                db.execute(
+                # Data is modified so it must be committed - write does that
+                # (see db.py).
+                write(lambda db: db.execute(
                     "INSERT INTO user (username, password) VALUES (?, ?)",
-                    (username, generate_password_hash(password)),
-                )
-                # We save the password as a hash for security.
-
-                # Data is modified so .commit() must be called to save the changes.
-                db.commit()
+                    (username, password_hash),
+                ))
+                mark_written()
             # Defined error if username already exists (from UNIQUE).
-            except db.IntegrityError:
+            except sqlite3.IntegrityError:
                 error = f"User {username} is already registered."
             else:
                 # url_for generates the URL for the login view based on its name.
@@ -91,8 +96,17 @@ def login():
         if user is None:
             error = 'Incorrect username.'
         # If the username does exist, check the password hash with the db hash pw.
-        elif not check_password_hash(user['password'], password):
+        elif not get_hasher().check(user['password'], password):
             error = 'Incorrect password.'
+        # The password is right, but was hashed with an old method or cost.
+        # This is the only time we have the plain password, so upgrade it now.
+        elif get_hasher().needs_rehash(user['password']):
+            password_hash = get_hasher().hash(password)
+            write(lambda db: db.execute(
+                'UPDATE user SET password = ? WHERE id = ?',
+                (password_hash, user['id'])
+            ))
+            forget_user(user['id'])
 
         # No errors imply correct username and password.
         if error is None:
@@ -100,8 +114,14 @@ def login():
             # When validation succeeds, the user's id is stored in a new session.
             # The data is stored in a *cookie* - sent to the browser, and becomes part
             # of subsequent requests. Flask signs this data.
+            # The time of the visitor's last write survives, so they keep
+            # reading from the primary until the replicas have it (see
+            # db.get_read_db) - often their own registration.
+            last_write = session.get('last_write')
             session.clear()
             session['user_id'] = user['id']
+            if last_write is not None:
+                session['last_write'] = last_write
             # Will be available on subsequent requests.
 
             return redirect(url_for('index'))
@@ -122,11 +142,43 @@ def load_logged_in_user():
 
     if user_id is None:
         g.user = None
+    elif isinstance(session, ServerSession):
+        # A server-side session carries the user's row (less the password
+        # hash), re-read once it is USER_CACHE_TTL seconds old - the same
+        # staleness the user cache allows.
+        ttl = current_app.config['USER_CACHE_TTL']
+        if 'user' not in session or (
+                ttl is not None
+                and time.time() - session['user_loaded'] > ttl):
+            user = get_user(user_id)
+            session['user'] = None if user is None else {
+                key: user[key] for key in user.keys() if key != 'password'
+            }
+            session['user_loaded'] = time.time()
+        g.user = session['user']
     else:
         # Store the data in g.user if so, which lasts the length of the request.
-        g.user = get_db().execute(
-            'SELECT * FROM user WHERE id = ?', (user_id,)
-        ).fetchone()
+        g.user = get_user(user_id)
+
+# The user's row, or None.
+def get_user(user_id):
+    # This runs before every request, so the user row is kept in an
+    # in-process cache and only read from the db on a miss.
+    cache = get_cache('USER')
+    user = cache.get(user_id)
+    if user is None:
+        sql = 'SELECT * FROM user WHERE id = ?'
+        user = get_read_db().execute(sql, (user_id,)).fetchone()
+        # A replica that is behind may not have the user yet.
+        if user is None:
+            user = get_db().execute(sql, (user_id,)).fetchone()
+        if user is not None:
+            cache.set(user_id, user)
+    return user
+
+# Drop a user from the cache - must be called whenever their row changes.
+def forget_user(user_id):
+    get_cache('USER').delete(user_id)
 
 # Create logout view to remove user from the session.
 @bp.route('/logout')
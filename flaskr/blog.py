@@ -3,14 +3,24 @@ Blog blueprint.
 https://flask.palletsprojects.com/en/2.0.x/tutorial/blog/
 """
 
+import functools
+import hashlib
+import json
+import sqlite3
+import unicodedata
+from datetime import datetime, timezone
+
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, make_response, redirect,
+    render_template, request, session, url_for
 )
+from markupsafe import Markup, escape
 from werkzeug.exceptions import abort
 
 # Login required function to access blog tools. (Checks user is logged in).
 from flaskr.auth import login_required
-from flaskr.db import get_db
+from flaskr.cache import get_cache
+from flaskr.db import get_db, get_read_db, mark_written, write
 
 
 # Create the Blueprint.
@@ -18,23 +28,400 @@ bp = Blueprint('blog', __name__)#, url_prefix='/blog')
 # Tutorial does not require url_prefix.
 
 
+# Turn a post row into a cursor string for the older/newer page links.
+# The cursor is the (created, id) pair of the post - id breaks ties between
+# posts created in the same second.
+def make_cursor(post):
+    return f"{post['created']}~{post['id']}"
+
+# Split a cursor from the query string back into its (created, id) pair.
+# Bad cursors are a client error, not a reason to show the first page.
+def parse_cursor(value):
+    created, sep, id = value.rpartition('~')
+    if not sep or not created or not id.isdigit():
+        abort(400, f"Invalid page cursor {value!r}.")
+    return created, int(id)
+
+# How queries get the post author's username, as (column, join clause).
+# Normally by joining post to user. In the read-optimized mode
+# (DENORMALIZED_AUTHOR) the username copied onto the post row is used and
+# the join is skipped.
+def author_join():
+    if current_app.config['DENORMALIZED_AUTHOR']:
+        return 'p.author_username AS username', ''
+    return 'u.username', ' JOIN user u ON p.author_id = u.id'
+
+# Fetch one page of posts using keyset (cursor) pagination.
+# Instead of OFFSET, which makes SQLite walk every skipped row, we seek
+# straight to the cursor position in the (created, id) index, so page N
+# costs the same as page 1. ?before=<cursor> pages to older posts and
+# ?after=<cursor> pages back to newer ones.
+# Returns the posts (newest first) and the cursors for the older and newer
+# links - None when there is no page in that direction.
+def get_posts_page(where=None, params=()):
+    per_page = current_app.config['POSTS_PER_PAGE']
+    before = request.args.get('before')
+    after = request.args.get('after')
+
+    conditions = [where] if where else []
+    params = tuple(params)
+    if after:
+        conditions.append('(p.created, p.id) > (?, ?)')
+        params += parse_cursor(after)
+        # Walk forwards from the cursor, then flip the page back round.
+        order = 'ASC'
+    else:
+        if before:
+            conditions.append('(p.created, p.id) < (?, ?)')
+            params += parse_cursor(before)
+        order = 'DESC'
+
+    username, join = author_join()
+    query = (
+        f'SELECT p.id, title, body, created, author_id, {username}, revision'
+        f' FROM post p{join}'
+    )
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += f' ORDER BY p.created {order}, p.id {order} LIMIT ?'
+
+    # Ask for one extra row to find out if there is another page.
+    posts = get_read_db().execute(
+        query, params + (per_page + 1,)
+    ).fetchall()
+    has_more = len(posts) > per_page
+    posts = posts[:per_page]
+    if after:
+        posts.reverse()
+
+    older = newer = None
+    if posts:
+        # Coming from a newer page means there is always an older one.
+        if has_more or after:
+            older = make_cursor(posts[-1])
+        # Likewise coming from an older page means there is a newer one.
+        if (after and has_more) or before:
+            newer = make_cursor(posts[0])
+
+    return posts, older, newer
+
+# Render one post's <article> from the fragment cache.
+# Posts are read far more often than they change, so each one is rendered
+# once per revision - update bumps the revision, which makes the old HTML
+# stale. Authors see an extra Edit link, so there are two versions per post.
+def render_post(post):
+    editable = g.user is not None and g.user['id'] == post['author_id']
+    cache = get_cache('FRAGMENT')
+    key = (post['id'], editable)
+
+    cached = cache.get(key)
+    if cached is not None and cached[0] == post['revision']:
+        return cached[1]
+
+    html = Markup(render_template(
+        'blog/_post.html', post=post, editable=editable
+    ))
+    cache.set(key, (post['revision'], html))
+    return html
+
+# Drop cached HTML after a post is created, changed or deleted.
+# Whole pages go, as any of them could show the post, plus the post's own
+# fragments when we know which post it was.
+def forget_posts(id=None):
+    get_cache('PAGE').clear()
+    if id is not None:
+        fragments = get_cache('FRAGMENT')
+        fragments.delete((id, True))
+        fragments.delete((id, False))
+        get_cache('POST').delete(id)
+
+# Version and last modification time of the posts, maintained by triggers
+# on every write (see blog_state in schema.sql). One row read by primary key.
+def get_blog_version():
+    state = get_read_db().execute(
+        'SELECT version, modified FROM blog_state WHERE id = 1'
+    ).fetchone()
+    return state['version'], state['modified'].replace(tzinfo=timezone.utc)
+
+# Identifies this build of the app: the fingerprinted static files (see
+# assets.py) and the time the app started. A deploy can change the pages
+# without changing any post, so ETags carry it too.
+def get_build_token():
+    app = current_app._get_current_object()
+    if 'build_token' not in app.extensions:
+        digest = hashlib.sha1(json.dumps(
+            app.extensions.get('static_manifest', {}), sort_keys=True
+        ).encode())
+        digest.update(repr(app.extensions['startup']['started_at']).encode())
+        app.extensions['build_token'] = digest.hexdigest()[:12]
+    return app.extensions['build_token']
+
+# Decorator for pages built only from the posts and the logged in user.
+# Answers If-None-Match / If-Modified-Since with 304 Not Modified when no
+# post changed since the client's copy, before the view runs at all - no
+# JOIN query, no rendering.
+def conditional(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        # A flashed message makes the page different from the cached copy.
+        if '_flashes' in session:
+            return view(**kwargs)
+
+        version, modified = get_blog_version()
+        g.blog_version = version
+        # The page shows who is logged in, so each user gets their own tag.
+        user_id = g.user['id'] if g.user is not None else 0
+        etag = f'{get_build_token()}-{version}-{user_id}'
+        # No page is older than the app that rendered it. Last-Modified
+        # has whole seconds only.
+        started = datetime.fromtimestamp(
+            int(current_app.extensions['startup']['started_at']),
+            timezone.utc
+        )
+        modified = max(modified, started)
+
+        # If-None-Match wins over If-Modified-Since when both are sent.
+        # Compressed pages carry a weak tag (see compress.py), so the tags
+        # are compared weakly, as RFC 7232 asks for If-None-Match anyway.
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since:
+            not_modified = modified <= request.if_modified_since
+        else:
+            not_modified = False
+
+        if not_modified:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(**kwargs))
+
+        response.set_etag(etag)
+        response.last_modified = modified
+        # Caches may store the page but must check it is still current.
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
+
+    return wrapped_view
+
+# Render a page of posts through the page cache.
+# Logged out visitors all see the same page, so the whole rendered page is
+# cached for them - unless there is a flashed message to show. The key
+# includes the posts version, so a write made by another worker makes the
+# cached copy unreachable too. build() renders the page on a miss.
+def cached_page(build):
+    cache = get_cache('PAGE')
+    shared = g.user is None and '_flashes' not in session
+    key = (request.full_path, g.get('blog_version'))
+    if shared:
+        page = cache.get(key)
+        if page is not None:
+            return page
+
+    page = build()
+    if shared:
+        cache.set(key, page)
+    return page
+
 # Define the route for the blog.
-# Index will show all the posts that were made thus far.
+# Index shows the newest posts, one page (POSTS_PER_PAGE) at a time.
 @bp.route('/')
+@conditional
 def index():
-    # Request connection to the database.
-    db = get_db()
-
-    # Get the posts from the database.
-    # Join with users table to get corresponding user id numbers.
-    posts = db.execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' ORDER BY created DESC'
-    ).fetchall()
+    def build():
+        # Get the current page of posts and the cursors for the page links.
+        posts, older, newer = get_posts_page()
+
+        # Render the template with the posts, pass the posts into the page.
+        return render_template(
+            'blog/index.html',
+            posts=[render_post(post) for post in posts],
+            older=older,
+            newer=newer,
+        )
+
+    return cached_page(build)
+
+# One author's posts, newest first, paged like the index. The
+# (author_id, created, id) index lets SQLite seek straight to the page, and
+# the post count is kept on the user row by triggers, so neither depends on
+# how many posts the author has written.
+@bp.route('/user/<username>')
+@conditional
+def author(username):
+    user = get_read_db().execute(
+        'SELECT id, username, post_count FROM user WHERE username = ?',
+        (username,)
+    ).fetchone()
+    if user is None:
+        abort(404, f"User {username} doesn't exist.")
+
+    def build():
+        posts, older, newer = get_posts_page('p.author_id = ?', (user['id'],))
+        return render_template(
+            'blog/author.html',
+            author=user,
+            posts=[render_post(post) for post in posts],
+            older=older,
+            newer=newer,
+        )
+
+    return cached_page(build)
+
+# Turn what the user typed into an FTS5 query. Each word is quoted, so
+# characters that mean something to FTS5 (", *, AND, NEAR, ...) are just
+# searched for, and all the words have to match. Control characters are
+# dropped first - a NUL ends the FTS5 string early. An empty result means
+# there is nothing to search for.
+def make_search_query(q):
+    terms = []
+    for term in q.split():
+        term = ''.join(
+            char for char in term
+            if not unicodedata.category(char).startswith('C')
+        )
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"')
+    return ' '.join(terms)
+
+# Whether SQLite refused a MATCH query, rather than failing to run it.
+def is_fts_syntax_error(e):
+    message = str(e)
+    return message.startswith('fts5:') or 'unterminated string' in message
+
+# Markers SQLite puts around matched words. They are control characters
+# that do not appear in normal text, so the text can be escaped first and
+# the markers swapped for <mark> tags afterwards - no user HTML gets through.
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+def highlight(text):
+    html = str(escape(text))
+    html = html.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+    return Markup(html)
 
-    # Render the template with the posts, pass the posts into the page.
-    return render_template('blog/index.html', posts=posts)
+# Search the posts with the full-text index, best matches first.
+@bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(400, 'Page numbers start at 1.')
+    per_page = current_app.config['SEARCH_RESULTS_PER_PAGE']
+
+    results = []
+    more = False
+    query = make_search_query(q)
+    if query:
+        # rank is FTS5's BM25 score. snippet() picks the best fragment of
+        # the body (column 1), highlight() marks the matches in the title.
+        # Ranked results have no stable key to seek on, so this is paged
+        # with OFFSET - fine for the first few pages people actually read.
+        username, join = author_join()
+        try:
+            rows = get_read_db().execute(
+                f'SELECT p.id, p.created, p.author_id, {username},'
+                ' highlight(post_fts, 0, ?, ?) AS title,'
+                " snippet(post_fts, 1, ?, ?, '…', 24) AS snippet"
+                ' FROM post_fts'
+                f' JOIN post p ON p.id = post_fts.rowid{join}'
+                ' WHERE post_fts MATCH ?'
+                ' ORDER BY rank LIMIT ? OFFSET ?',
+                (_MARK_START, _MARK_END, _MARK_START, _MARK_END,
+                 query, per_page + 1, (page - 1) * per_page)
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            # Quoting should leave nothing FTS5 can refuse, but if it does,
+            # that is a bad search rather than a server error.
+            if not is_fts_syntax_error(e):
+                raise
+            abort(400, 'That search could not be understood.')
+        more = len(rows) > per_page
+        results = [
+            {
+                'id': row['id'],
+                'title': highlight(row['title']),
+                'snippet': highlight(row['snippet']),
+                'username': row['username'],
+                'created': row['created'],
+            }
+            for row in rows[:per_page]
+        ]
+
+    return render_template(
+        'blog/search.html', q=q, results=results, page=page, more=more
+    )
+
+# A single post on its own page, for sharing.
+# The ETag is the post's revision, which update bumps, so browsers and
+# proxies revalidate with a single primary key lookup and get 304 back until
+# the post changes - or the app does (see get_build_token). Logged out visitors all get the same page, so proxies
+# may keep it for POST_MAX_AGE seconds and this worker keeps the rendered
+# page in the POST cache. Pages for logged in users carry their name and
+# Edit link, so those stay private.
+@bp.route('/<int:id>')
+def detail(id):
+    post = get_post(id, check_author=False)
+    user_id = g.user['id'] if g.user is not None else 0
+    etag = f"{get_build_token()}-{post['id']}-{post['revision']}" \
+        f'-{user_id}'
+    shared = g.user is None and '_flashes' not in session
+
+    if shared and request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        cache = get_cache('POST')
+        cached = cache.get(id) if shared else None
+        if cached is not None and cached[0] == post['revision']:
+            page = cached[1]
+        else:
+            page = render_template(
+                'blog/detail.html', post=post, article=render_post(post)
+            )
+            if shared:
+                cache.set(id, (post['revision'], page))
+        response = make_response(page)
+
+    response.vary.add('Cookie')
+    if shared:
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['POST_MAX_AGE']
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+# Post writes shared by the pages and the API (see api.py). Each commits
+# through db.write, marks the session for read-your-writes and drops the
+# cached HTML the post may be in.
+
+# Add a post by the logged in user and return its id. The username is
+# copied onto the post for the read-optimized mode (see author_join).
+def create_post(title, body):
+    values = (title, body, g.user['id'], g.user['username'])
+    id = write(lambda db: db.execute(
+        'INSERT INTO post (title, body, author_id, author_username)'
+        ' VALUES (?, ?, ?, ?)',
+        values
+    ).lastrowid)
+    mark_written()
+    forget_posts()
+    return id
+
+# The revision number tells caches their copy is out of date.
+def update_post(id, title, body):
+    write(lambda db: db.execute(
+        'UPDATE post SET title = ?, body = ?, revision = revision + 1'
+        ' WHERE id = ?',
+        (title, body, id)
+    ))
+    mark_written()
+    forget_posts(id)
+
+def delete_post(id):
+    write(lambda db: db.execute('DELETE FROM post WHERE id = ?', (id,)))
+    mark_written()
+    forget_posts(id)
 
 # Define a route for a user to create a blog post.
 # Use the decorator to ensure the user is logged in before being able to access
@@ -57,16 +444,8 @@ def create():
         if error is not None:
             flash(error)
         else:
-            # Request db connection.
-            db = get_db()
-            # Add the new post to the database.
-            db.execute(
-                'INSERT INTO post (title, body, author_id)'
-                ' VALUES (?, ?, ?)',
-                (title, body, g.user['id'])
-            )
-            # Commit the changes to the database (data modification).
-            db.commit()
+            # Add the new post to the database and commit (see db.write).
+            create_post(title, body)
             # Return user to homepage to see their new post.
             return redirect(url_for('blog.index'))
 
@@ -77,10 +456,13 @@ def create():
 # Include check_author=True to allow us to display a single post
 # on a page and remove the need to check for a user if not required.
 def get_post(id, check_author=True):
-    # Connect to the database and perform a search for the id.
-    post = get_db().execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
+    # Connect to the database and perform a search for the id. Only posts
+    # about to be edited have to come from the primary.
+    username, join = author_join()
+    db = get_db() if check_author else get_read_db()
+    post = db.execute(
+        f'SELECT p.id, title, body, created, author_id, {username}, revision'
+        f' FROM post p{join}'
         ' WHERE p.id = ?',
         (id,)
     ).fetchone()
@@ -121,14 +503,8 @@ def update(id):
         if error is not None:
             flash(error)
         else:
-            # Connect to db and update the row with the new information.
-            db = get_db()
-            db.execute(
-                'UPDATE post SET title = ?, body = ?'
-                ' WHERE id = ?',
-                (title, body, id)
-            )
-            db.commit()
+            # Update the row with the new information.
+            update_post(id, title, body)
             # Redirect the user back to the homepage.
             return redirect(url_for('blog.index'))
 
@@ -141,8 +517,6 @@ def update(id):
 def delete(id):
     # Check the post exists in order to delete it.
     get_post(id)
-    # Connect to db and run SQL command to delete the post.
-    db = get_db()
-    db.execute('DELETE FROM post WHERE id = ?', (id,))
-    db.commit()
+    # Run the SQL command to delete the post.
+    delete_post(id)
     return redirect(url_for('blog.index'))
@@ -0,0 +1,198 @@
+"""
+Bulk import and export of users and posts.
+The export commands stream rows straight from the SQLite cursor to the
+output, and the import commands read their input in batches and insert
+each batch with executemany, all inside one transaction - so memory use
+stays the same however big the file is, and a failed import changes
+nothing.
+
+    flask export-posts posts.jsonl
+    flask import-posts posts.jsonl --defer-indexes
+    flask export-users users.csv --format csv
+"""
+
+import csv
+import itertools
+import json
+from datetime import datetime, timezone
+
+import click
+from flask.cli import with_appcontext
+
+from flaskr.db import get_db
+
+# Columns of each table that are exported and imported, in file order.
+TABLES = {
+    'user': ('id', 'username', 'password'),
+    'post': ('id', 'author_id', 'created', 'title', 'body'),
+}
+FORMATS = ('jsonl', 'csv')
+
+
+# Write every row of a table to out, reporting progress every batch_size
+# rows. Iterating the cursor fetches rows as they are written, rather than
+# loading them all with fetchall().
+def export_rows(table, out, format, batch_size):
+    columns = TABLES[table]
+    cursor = get_db().execute(
+        f"SELECT {', '.join(columns)} FROM {table} ORDER BY id"
+    )
+
+    if format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        write = writer.writerow
+    else:
+        def write(row):
+            out.write(json.dumps(dict(zip(columns, row)), default=str))
+            out.write('\n')
+
+    count = 0
+    for row in cursor:
+        write(tuple(row))
+        count += 1
+        if count % batch_size == 0:
+            click.echo(f'Exported {count} {table} rows...', err=True)
+
+    click.echo(f'Exported {count} {table} rows.', err=True)
+    return count
+
+
+# created as SQLite stores it, YYYY-MM-DD HH:MM:SS in UTC. Anything else
+# would be read back by the timestamp converter on every page showing the
+# post, and fail there. Accepts ISO 8601, with or without a time zone.
+def parse_created(value, line):
+    if isinstance(value, str):
+        text = value.strip()
+        if text.endswith('Z'):
+            text = text[:-1] + '+00:00'
+        try:
+            created = datetime.fromisoformat(text)
+        except ValueError:
+            pass
+        else:
+            if created.tzinfo is not None:
+                created = created.astimezone(timezone.utc).replace(tzinfo=None)
+            return created.strftime('%Y-%m-%d %H:%M:%S')
+    raise click.ClickException(
+        f'Record {line}: created {value!r} is not an ISO 8601 date and time.'
+    )
+
+
+# Read rows from a JSON Lines or CSV file as tuples in column order.
+# Missing or empty values become None - the id is then assigned by SQLite
+# and created defaults to the current time.
+def read_rows(table, file, format):
+    columns = TABLES[table]
+    if format == 'csv':
+        records = csv.DictReader(file)
+    else:
+        records = (json.loads(line) for line in file if line.strip())
+
+    for line, record in enumerate(records, 1):
+        row = []
+        for column in columns:
+            value = record.get(column)
+            if value in (None, ''):
+                value = None
+            elif column == 'created':
+                value = parse_created(value, line)
+            row.append(value)
+        yield tuple(row)
+
+
+# Indexes and triggers that slow a big load down row by row. Deferring
+# them drops them first and builds them once at the end, which is much
+# faster than keeping them up to date through every insert.
+def deferrable(db, table):
+    objects = db.execute(
+        "SELECT type, name, sql FROM sqlite_master"
+        " WHERE tbl_name = ? AND sql IS NOT NULL"
+        " AND (type = 'index' OR (type = 'trigger' AND name LIKE '%_fts'))",
+        (table,)
+    ).fetchall()
+    return [(row['type'], row['name'], row['sql']) for row in objects]
+
+
+# Insert rows from the file in batches within a single transaction.
+def import_rows(table, file, format, batch_size, defer_indexes):
+    db = get_db()
+    columns = TABLES[table]
+    values = ', '.join(
+        'COALESCE(?, CURRENT_TIMESTAMP)' if column == 'created' else '?'
+        for column in columns
+    )
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values})"
+
+    rows = read_rows(table, file, format)
+    count = 0
+    # Open the transaction explicitly so the DROP/CREATE statements for the
+    # deferred indexes are part of it too.
+    db.execute('BEGIN')
+    try:
+        deferred = deferrable(db, table) if defer_indexes else []
+        for type, name, sql in deferred:
+            db.execute(f'DROP {type.upper()} {name}')
+
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            db.executemany(insert, batch)
+            count += len(batch)
+            click.echo(f'Imported {count} {table} rows...', err=True)
+
+        if deferred:
+            click.echo('Building deferred indexes...', err=True)
+            for type, name, sql in deferred:
+                db.execute(sql)
+            # The search index missed the new posts while its trigger was
+            # gone, so it is rebuilt in one pass.
+            if table == 'post':
+                db.execute(
+                    "INSERT INTO post_fts (post_fts) VALUES ('rebuild')"
+                )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    click.echo(f'Imported {count} {table} rows.', err=True)
+    return count
+
+
+# Build the export and import commands for one table.
+def make_commands(table, plural):
+    @click.command(f'export-{plural}')
+    @click.argument('output', type=click.File('w'), default='-')
+    @click.option('--format', type=click.Choice(FORMATS), default='jsonl',
+                  show_default=True)
+    @click.option('--batch-size', default=10000, show_default=True,
+                  help='Rows between progress reports.')
+    @with_appcontext
+    def export_command(output, format, batch_size):
+        export_rows(table, output, format, batch_size)
+
+    export_command.help = f'Export all {plural} as JSON Lines or CSV.'
+
+    @click.command(f'import-{plural}')
+    @click.argument('input', type=click.File('r'), default='-')
+    @click.option('--format', type=click.Choice(FORMATS), default='jsonl',
+                  show_default=True)
+    @click.option('--batch-size', default=5000, show_default=True,
+                  help='Rows inserted per executemany call.')
+    @click.option('--defer-indexes', is_flag=True,
+                  help='Drop the indexes during the load, rebuild after.')
+    @with_appcontext
+    def import_command(input, format, batch_size, defer_indexes):
+        import_rows(table, input, format, batch_size, defer_indexes)
+
+    import_command.help = f'Import {plural} from JSON Lines or CSV.'
+
+    return export_command, import_command
+
+
+def init_app(app):
+    for table, plural in (('user', 'users'), ('post', 'posts')):
+        for command in make_commands(table, plural):
+            app.cli.add_command(command)
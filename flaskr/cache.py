@@ -0,0 +1,106 @@
+"""
+In-process caches.
+A small least-recently-used cache with an optional time to live, used to
+keep hot rows and rendered HTML in memory between requests. Every worker
+process has its own caches, so entries either expire or are invalidated
+explicitly when the data behind them changes.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+# Thread-safe LRU cache. maxsize=0 turns it off (nothing is stored) and
+# ttl=None keeps entries until they are evicted or invalidated.
+# None is not a cacheable value - get() returns None for a miss.
+class LRUCache(object):
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expiry time, value), oldest first.
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            # Mark as most recently used.
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    # Drop one entry, when the data it was built from has changed.
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+# Returns the named cache of the current app, creating it on first use.
+# Sizes come from the <NAME>_CACHE_SIZE and <NAME>_CACHE_TTL config keys.
+def get_cache(name, app=None):
+    app = app or current_app
+    caches = app.extensions.setdefault('caches', {})
+
+    if name not in caches:
+        caches[name] = LRUCache(
+            maxsize=app.config[f'{name}_CACHE_SIZE'],
+            ttl=app.config[f'{name}_CACHE_TTL'],
+        )
+
+    return caches[name]
+
+
+# Statistics for every cache the app has created, for monitoring.
+def cache_stats(app=None):
+    app = app or current_app
+    caches = app.extensions.get('caches', {})
+    return {name: cache.stats() for name, cache in caches.items()}
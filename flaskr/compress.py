@@ -0,0 +1,120 @@
+"""
+Response compression.
+HTML pages and API responses compress to a fraction of their size, which
+matters far more to a visitor on a slow connection than the little CPU it
+costs. Responses of COMPRESS_MIMETYPES at least COMPRESS_MIN_SIZE bytes
+are compressed with brotli when the client accepts it and the brotli
+package is installed (pip install flaskr[brotli]), gzip otherwise.
+Streamed responses, such as the API's lists, are compressed chunk by chunk
+as they are sent.
+
+Files are left to assets.py, which serves them pre-compressed.
+"""
+
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Encodings we can produce, best first.
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# The best of `encodings` the client accepts, or None.
+def choose_encoding(encodings):
+    accept = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+# Incremental compressor for one response, with the same two methods for
+# both encodings. Output comes out whenever the compressor has a block
+# ready, so a streamed response stays streamed without flushing (and
+# compressing worse) after every small chunk.
+# level is the gzip level. Brotli always uses quality 4 of 11, which
+# compresses better than gzip 6 in about the same time.
+class Compressor(object):
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=4)
+        else:
+            # wbits=31 writes the gzip header and trailer.
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def compress_stream(chunks, compressor):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        # Let stream_with_context and friends clean up.
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response):
+    config = current_app.config
+    # Files (direct passthrough) are served by assets.py, already encoded.
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in config['COMPRESS_MIMETYPES']
+            or request.method == 'HEAD'):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if not response.is_streamed \
+            and len(response.get_data()) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = choose_encoding(available_encodings())
+    if encoding is None:
+        return response
+
+    compressor = Compressor(encoding, config['COMPRESS_LEVEL'])
+    if response.is_streamed:
+        response.response = compress_stream(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(
+            compressor.compress(response.get_data()) + compressor.finish()
+        )
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed bytes differ from the uncompressed ones, so a strong
+    # ETag no longer holds - but the page is still the same, so weak
+    # comparison (If-None-Match) keeps matching.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    # Registered early, so it runs after the other after_request hooks.
+    app.after_request(compress_response)
@@ -4,7 +4,9 @@ https://flask.palletsprojects.com/en/2.0.x/tutorial/database/
 """
 
 # Dependencies.
+import functools
 import sqlite3
+import time
 
 import click
 
@@ -15,29 +17,182 @@ import click
 from flask import g
 # Special object that points to the Flask app handling the request.
 from flask import current_app
+from flask import session
 from flask.cli import with_appcontext
 
+from flaskr.pool import ConnectionPool
+from flaskr.replicas import ReplicaSet
+from flaskr.writer import GroupCommitWriter
+from flaskr.querylog import InstrumentedConnection, record_queries
+
+
+# Modes accepted by PRAGMA wal_checkpoint, see the db-checkpoint command.
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+# Open and set up a new connection to the database file.
+# Pooled connections are handed between request threads, so sqlite3's
+# same-thread check is turned off - the pool makes sure only one request
+# uses a connection at a time.
+def connect(database, pragmas=None):
+    db = sqlite3.connect(
+        database,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False
+    )
+    # Tells the connection to return rows that behave like dicts -
+    # can access the columns by name.
+    db.row_factory = sqlite3.Row
+
+    # Apply the pragma profile once, when the connection is opened.
+    # Pooled connections keep their settings for as long as they live.
+    for name, value in (pragmas or {}).items():
+        if not name.isidentifier():
+            raise ValueError(f"Invalid pragma name {name!r}.")
+        db.execute(f'PRAGMA {name} = {value}').fetchall()
+
+    return db
+
+# Returns the connection pool for the configured database, creating it the
+# first time it is needed. One pool per app per database file.
+def get_pool(app=None):
+    app = app or current_app
+    database = app.config['DATABASE']
+    pools = app.extensions.setdefault('db_pools', {})
+
+    if database not in pools:
+        pools[database] = ConnectionPool(
+            functools.partial(
+                connect, database, app.config['DATABASE_PRAGMAS']
+            ),
+            size=app.config['DATABASE_POOL_SIZE'],
+            timeout=app.config['DATABASE_POOL_TIMEOUT'],
+        )
+
+    return pools[database]
+
+# Hit/miss/wait counters of the pool, for monitoring.
+def pool_stats(app=None):
+    return get_pool(app).stats()
+
+# Returns the read-only replicas listed in DATABASE_REPLICAS (see
+# replicas.py), or None when there are none.
+def get_replicas(app=None):
+    app = app or current_app
+    if not app.config['DATABASE_REPLICAS']:
+        return None
+
+    if 'db_replicas' not in app.extensions:
+        app.extensions['db_replicas'] = ReplicaSet(
+            app.config['DATABASE'],
+            app.config['DATABASE_REPLICAS'],
+            connect,
+            pragmas=app.config['DATABASE_PRAGMAS'],
+            size=app.config['DATABASE_POOL_SIZE'] or 1,
+            timeout=app.config['DATABASE_POOL_TIMEOUT'],
+            interval=app.config['REPLICA_SYNC_INTERVAL'],
+        )
+
+    return app.extensions['db_replicas']
+
+# Time and count every statement, see querylog.py.
+def _instrument(db):
+    if current_app.config['QUERY_STATS']:
+        return InstrumentedConnection(db)
+    return db
 
 # Will be called when the application has been created and is handling a request.
 def get_db():
     if 'db' not in g:
-        # Established a connection to the file pointed at by the DATABASE config key.
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        # Tells the connection to return rows that behave like dicts -
-        # can access the columns by name.
-        g.db.row_factory = sqlite3.Row
+        # Borrow a ready connection to the file pointed at by the DATABASE
+        # config key. DATABASE_POOL_SIZE = 0 opens a new one every time.
+        if current_app.config['DATABASE_POOL_SIZE']:
+            g.db = get_pool().connection()
+        else:
+            g.db = connect(
+                current_app.config['DATABASE'],
+                current_app.config['DATABASE_PRAGMAS']
+            )
+        g.db = _instrument(g.db)
 
     return g.db
 
+# The group commit writer (see writer.py), one per app and database file.
+def get_writer(app=None):
+    app = app or current_app
+    database = app.config['DATABASE']
+    writers = app.extensions.setdefault('db_writers', {})
+
+    if database not in writers:
+        writers[database] = GroupCommitWriter(
+            functools.partial(
+                connect, database, app.config['DATABASE_PRAGMAS']
+            ),
+            window=app.config['GROUP_COMMIT_WINDOW_MS'] / 1000,
+            max_batch=app.config['GROUP_COMMIT_MAX_BATCH'],
+        )
+
+    return writers[database]
+
+# Run fn(db), which makes changes without committing them, and commit.
+# Returns what fn returns, and raises what it raises (IntegrityError, ...)
+# with its changes rolled back. With GROUP_COMMIT on, fn runs on the
+# writer thread together with other requests' writes - so it must not use
+# g or request, only values taken from them beforehand.
+def write(fn):
+    if current_app.config['GROUP_COMMIT']:
+        return get_writer().run(
+            fn, timeout=current_app.config['DATABASE_POOL_TIMEOUT']
+        )
+
+    db = get_db()
+    try:
+        result = fn(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result
+
+# Connection for views that only read. Goes to a replica when there are
+# any and they already have this visitor's last write, and to the primary
+# otherwise - including when the request has already used the primary.
+def get_read_db():
+    if 'db' in g:
+        return g.db
+
+    if 'read_db' not in g:
+        replicas = get_replicas()
+        if replicas is None:
+            return get_db()
+        replicas.start()
+        if not replicas.fresh_for(session.get('last_write')):
+            return get_db()
+        g.read_db = _instrument(replicas.connection())
+
+    return g.read_db
+
+# Call after committing a write, so this visitor reads from the primary
+# until the replicas have caught up with it.
+def mark_written():
+    replicas = get_replicas()
+    if replicas is None:
+        return
+    session['last_write'] = time.time()
+    if current_app.config['REPLICA_SYNC_ON_WRITE']:
+        replicas.request_sync()
+
 def close_db(e=None):
-    # Checks is g.db was set - if it was then it closes the connection.
-    db = g.pop('db', None)
+    # Checks is g.db was set - if it was then it is closed, which gives a
+    # pooled connection back to the pool. The same for a replica.
+    for name in ('db', 'read_db'):
+        db = g.pop(name, None)
 
-    if db is not None:
-        db.close()
+        if db is not None:
+            # Hand the recorded statements over while the connection can
+            # still be used to explain the slow ones.
+            if isinstance(db, InstrumentedConnection):
+                record_queries(db)
+            db.close()
 
 # Initialize database function.
 def init_db():
@@ -49,6 +204,11 @@ def init_db():
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf-8'))
 
+    # schema.sql is always the latest schema, so every migration counts as
+    # applied to a new database.
+    from flaskr import migrations
+    migrations.stamp(db)
+
 # Defines a command link command called 'init-db' that calls the init_db
 # function and shows a success message to the user.
 @click.command('init-db')
@@ -58,6 +218,98 @@ def init_db_command():
     init_db()
     click.echo('Initialized the database.')
 
+# Copy the write-ahead log back into the database file.
+# SQLite checkpoints on its own every 1000 pages (PASSIVE), this command is
+# for forcing one, e.g. TRUNCATE to shrink the -wal file after a bulk load.
+@click.command('db-checkpoint')
+@click.option(
+    '--mode', default='PASSIVE', show_default=True,
+    type=click.Choice(CHECKPOINT_MODES, case_sensitive=False)
+)
+@with_appcontext
+def db_checkpoint_command(mode):
+    """Checkpoint the write-ahead log into the database file."""
+    busy, log, checkpointed = get_db().execute(
+        f'PRAGMA wal_checkpoint({mode.upper()})'
+    ).fetchone()
+    if busy:
+        click.echo('Checkpoint could not complete, the database is busy.')
+    click.echo(f'Checkpointed {checkpointed} of {log} WAL pages.')
+
+# Rebuild the full-text search index from the post table in one go.
+# The triggers keep it in step normally - this is for after loading posts
+# with the triggers missing, or if the index is ever suspected to be wrong.
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    """Rebuild the full-text search index over posts."""
+    db = get_db()
+    db.execute("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+    # Merge the index b-trees into one, which makes queries faster.
+    db.execute("INSERT INTO post_fts (post_fts) VALUES ('optimize')")
+    db.commit()
+    count = db.execute('SELECT COUNT(*) FROM post').fetchone()[0]
+    click.echo(f'Rebuilt the search index for {count} posts.')
+
+# Triggers keeping post.author_username filled in, as in schema.sql.
+AUTHOR_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS post_insert_author AFTER INSERT ON post
+WHEN NEW.author_username IS NULL BEGIN
+  UPDATE post SET author_username = (
+    SELECT username FROM user WHERE id = NEW.author_id
+  ) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_update_author
+AFTER UPDATE OF author_id ON post BEGIN
+  UPDATE post SET author_username = (
+    SELECT username FROM user WHERE id = NEW.author_id
+  ) WHERE id = NEW.id;
+END;
+"""
+
+# Bring a database created before post.author_username existed up to date:
+# add the column and its triggers, then copy the usernames over. The copy
+# walks the posts by id a batch at a time and commits after each batch, so
+# writers only ever wait for one batch. Also migration 6, see migrations.py.
+def denormalize_authors(db, batch_size=1000):
+    columns = [row['name'] for row in db.execute('PRAGMA table_info(post)')]
+    if 'author_username' not in columns:
+        db.execute('ALTER TABLE post ADD COLUMN author_username TEXT')
+    db.executescript(AUTHOR_TRIGGERS)
+
+    last_id = db.execute('SELECT MAX(id) FROM post').fetchone()[0] or 0
+    updated = 0
+    for start in range(0, last_id, batch_size):
+        updated += db.execute(
+            'UPDATE post SET author_username = ('
+            '  SELECT username FROM user WHERE id = post.author_id'
+            ') WHERE id > ? AND id <= ?',
+            (start, start + batch_size)
+        ).rowcount
+        db.commit()
+    return updated
+
+@click.command('denormalize-authors')
+@click.option('--batch-size', default=1000, show_default=True)
+@with_appcontext
+def denormalize_authors_command(batch_size):
+    """Copy author usernames onto posts for the read-optimized mode."""
+    updated = denormalize_authors(get_db(), batch_size)
+    click.echo(f'Copied author usernames onto {updated} posts.')
+
+# Copy the database onto the replicas now, e.g. right after a migration.
+@click.command('sync-replicas')
+@with_appcontext
+def sync_replicas_command():
+    """Copy the database onto the read replicas."""
+    replicas = get_replicas()
+    if replicas is None:
+        click.echo('No replicas are configured.')
+        return
+    replicas.sync()
+    click.echo(f'Copied the database to {len(replicas.paths)} replicas.')
+
 # Register with the Application.
 # Writing a function that takes an application and does the registration.
 def init_app(app):
@@ -65,3 +317,11 @@ def init_app(app):
     app.teardown_appcontext(close_db)
     # Adds a new command that can be called with the flask command.
     app.cli.add_command(init_db_command)
+    app.cli.add_command(db_checkpoint_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(denormalize_authors_command)
+    app.cli.add_command(sync_replicas_command)
+
+    # Versioned schema migrations - db-upgrade and db-status.
+    from flaskr import migrations
+    migrations.init_app(app)
@@ -0,0 +1,132 @@
+"""
+Password hashing off the request thread.
+Hashing is deliberately slow - hundreds of milliseconds of CPU - so doing it
+inline in register and login lets a burst of logins take every worker thread.
+Hashes run in a small process pool instead, and once too many are waiting
+new ones are refused with 503 so the other pages keep working.
+"""
+
+import threading
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+)
+
+
+# Raised when the hashing queue is full. Flask turns it into a 503 response
+# with a Retry-After header.
+class HashingOverloaded(ServiceUnavailable):
+    description = 'Too many logins at once, please try again shortly.'
+
+
+# The method as werkzeug writes it at the start of a hash - pbkdf2 always
+# with its iterations, even when the method leaves them to the default.
+def stored_method(method):
+    if method.startswith('pbkdf2:'):
+        args = method[7:].split(':')
+        if len(args) == 1:
+            return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+        if len(args) == 2:
+            return f'pbkdf2:{args[0]}:{int(args[1] or 0)}'
+    return method
+
+
+# Runs password hashes in a process pool, at most max_pending at a time.
+# method is a werkzeug hash method including the cost, such as
+# 'pbkdf2:sha256:260000'. workers=0 hashes on the calling thread, still
+# subject to the max_pending limit.
+class PasswordHasher(object):
+    def __init__(self, method, workers=2, max_pending=16):
+        self.method = method
+        self._prefix = stored_method(method)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending) \
+            if max_pending else None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+
+    # Processes are only started once the first password is hashed, so
+    # apps that never hash (CLI commands, tests) do not pay for them - nor
+    # for importing multiprocessing. They are never forked from the app
+    # process, whose other threads may hold locks (the sweepers, the
+    # writer) that the children would inherit held: they come from a
+    # forkserver, or are spawned where there is none.
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context(
+                    'forkserver' if 'forkserver' in methods else 'spawn'
+                )
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=context
+                )
+            return self._executor
+
+    # The counters are bumped from every request thread.
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _run(self, fn, *args):
+        # Shed load rather than queue behind a login storm.
+        if self._slots is None or not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise HashingOverloaded(retry_after=1)
+
+        try:
+            if self.workers:
+                result = self._get_executor().submit(fn, *args).result()
+            else:
+                result = fn(*args)
+        finally:
+            self._slots.release()
+
+        self._count('completed')
+        return result
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    # True when a stored hash was made with a different method or cost than
+    # the configured one, so it should be replaced at the next login.
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+
+# Returns the current app's hasher, set up from the PASSWORD_HASH_* config.
+def get_hasher(app=None):
+    app = app or current_app
+
+    if 'password_hasher' not in app.extensions:
+        app.extensions['password_hasher'] = PasswordHasher(
+            app.config['PASSWORD_HASH_METHOD'],
+            workers=app.config['PASSWORD_HASH_WORKERS'],
+            max_pending=app.config['PASSWORD_HASH_QUEUE'],
+        )
+
+    return app.extensions['password_hasher']
@@ -0,0 +1,299 @@
+"""
+Prometheus-style metrics.
+Request latency, DB time, template render time and response size per
+endpoint, requests in progress, and the connection pool and cache
+counters, served from /metrics in the Prometheus text format.
+
+Each metric is split into a fixed number of shards, each with its own
+lock, and every thread records into one of them, so requests rarely wait
+on each other - the shards are only added up when /metrics is scraped.
+"""
+
+import itertools
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, request
+
+from flaskr.cache import cache_stats
+from flaskr.db import pool_stats
+from flaskr.querylog import request_records
+
+# Bucket upper bounds. Latencies in seconds, sizes in bytes.
+TIME_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+# Shards per metric. A fixed number, so a server starting a thread per
+# request does not grow them.
+SHARDS = 16
+
+
+# Base for sharded metrics. Each shard is a dict of label values -> data
+# with its own lock. Threads are given shards in turn the first time they
+# record, and keep theirs.
+class ShardedMetric(object):
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._next = itertools.count()
+        self._shards = [({}, threading.Lock()) for _ in range(SHARDS)]
+
+    def _labels(self, values, extra=()):
+        return tuple(zip(self.labelnames, values)) + tuple(extra)
+
+    # This thread's (shard, lock).
+    def _shard(self):
+        index = getattr(self._local, 'index', None)
+        if index is None:
+            index = self._local.index = next(self._next) % SHARDS
+        return self._shards[index]
+
+    # Copies of all shards' items, histogram counts included.
+    def _collect_shards(self):
+        collected = []
+        for shard, lock in self._shards:
+            with lock:
+                collected.append([
+                    (labels, list(data) if isinstance(data, list) else data)
+                    for labels, data in shard.items()
+                ])
+        return collected
+
+
+# Counter that can also go down, e.g. requests in progress. Added up over
+# the shards - each shard's own value may be negative.
+class Gauge(ShardedMetric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, *labels):
+        shard, lock = self._shard()
+        with lock:
+            shard[labels] = shard.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    def samples(self):
+        totals = {}
+        for items in self._collect_shards():
+            for labels, value in items:
+                totals[labels] = totals.get(labels, 0) + value
+        for labels, value in sorted(totals.items()):
+            yield self.name, self._labels(labels), value
+
+
+# Only counts up, e.g. number of requests.
+class Counter(Gauge):
+    kind = 'counter'
+
+    def dec(self, amount=1, *labels):
+        raise ValueError('Counters only go up.')
+
+
+# Histogram with fixed buckets. Each shard keeps, per label values, the
+# count in every bucket (not cumulative, so an observation touches one
+# slot), then the count above the last bucket, then the sum.
+class Histogram(ShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        bucket = bisect_left(self.buckets, value)
+        shard, lock = self._shard()
+        with lock:
+            counts = shard.get(labels)
+            if counts is None:
+                counts = shard[labels] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    def samples(self):
+        totals = {}
+        for items in self._collect_shards():
+            for labels, counts in items:
+                total = totals.setdefault(
+                    labels, [0] * (len(self.buckets) + 1) + [0.0]
+                )
+                for i, count in enumerate(counts):
+                    total[i] += count
+
+        for labels, counts in sorted(totals.items()):
+            cumulative = 0
+            bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       self._labels(labels, (('le', bound),)), cumulative)
+            yield self.name + '_sum', self._labels(labels), counts[-1]
+            yield self.name + '_count', self._labels(labels), cumulative
+
+
+# Metric whose samples are read from somewhere else at scrape time, such
+# as the pool counters. read() returns (label values, value) pairs.
+class CallbackMetric(object):
+    def __init__(self, name, help, kind, labelnames, read):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = labelnames
+        self._read = read
+
+    def samples(self):
+        for labels, value in self._read():
+            yield self.name, tuple(zip(self.labelnames, labels)), value
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+# Render metrics in the Prometheus text exposition format.
+def render(metrics):
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            if labels:
+                pairs = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+                name = f'{name}{{{pairs}}}'
+            lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# All the metrics of one app.
+class Metrics(object):
+    def __init__(self, app):
+        self.requests = Counter(
+            'flaskr_requests_total', 'Requests handled.',
+            ('endpoint', 'method', 'status')
+        )
+        self.in_progress = Gauge(
+            'flaskr_requests_in_progress', 'Requests being handled.'
+        )
+        self.latency = Histogram(
+            'flaskr_request_duration_seconds', 'Time to handle a request.',
+            ('endpoint',)
+        )
+        self.db_time = Histogram(
+            'flaskr_db_duration_seconds', 'Time spent in SQLite per request.',
+            ('endpoint',)
+        )
+        self.render_time = Histogram(
+            'flaskr_template_render_seconds',
+            'Time spent rendering templates per request.', ('endpoint',)
+        )
+        self.size = Histogram(
+            'flaskr_response_size_bytes', 'Size of response bodies.',
+            ('endpoint',), buckets=SIZE_BUCKETS
+        )
+
+        def read_pool():
+            stats = pool_stats(app)
+            return [(('idle',), stats['idle']), (('in_use',), stats['in_use'])]
+
+        def read_pool_events():
+            stats = pool_stats(app)
+            return [((event,), stats[event])
+                    for event in ('hits', 'misses', 'waits', 'timeouts')]
+
+        def read_caches(field):
+            def read():
+                return [((name,), stats[field])
+                        for name, stats in sorted(cache_stats(app).items())]
+            return read
+
+        def read_startup():
+            startup = app.extensions.get('startup', {})
+            return [((phase,), startup[key]) for phase, key in (
+                ('total', 'seconds'), ('templates', 'template_seconds')
+            ) if key in startup]
+
+        self.callbacks = [
+            CallbackMetric(
+                'flaskr_db_connections', 'Pooled database connections.',
+                'gauge', ('state',), read_pool
+            ),
+            CallbackMetric(
+                'flaskr_db_pool_events_total', 'Connection pool checkouts.',
+                'counter', ('event',), read_pool_events
+            ),
+            CallbackMetric(
+                'flaskr_cache_hits_total', 'In-process cache hits.',
+                'counter', ('cache',), read_caches('hits')
+            ),
+            CallbackMetric(
+                'flaskr_cache_misses_total', 'In-process cache misses.',
+                'counter', ('cache',), read_caches('misses')
+            ),
+            CallbackMetric(
+                'flaskr_startup_seconds', 'Time taken to create the app.',
+                'gauge', ('phase',), read_startup
+            ),
+        ]
+
+    def all(self):
+        return [
+            self.requests, self.in_progress, self.latency, self.db_time,
+            self.render_time, self.size,
+        ] + self.callbacks
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+    current_app.extensions['metrics'].in_progress.inc()
+
+def record_response(response):
+    metrics = current_app.extensions['metrics']
+    endpoint = request.endpoint or 'none'
+    metrics.requests.inc(1, endpoint, request.method, str(response.status_code))
+    metrics.latency.observe(
+        time.perf_counter() - g.metrics_start, endpoint
+    )
+
+    # Filled in by the query instrumentation and render signals.
+    records = request_records()
+    if records is not None:
+        metrics.db_time.observe(
+            sum(record.elapsed for record in records), endpoint
+        )
+    metrics.render_time.observe(g.get('render_time', 0.0), endpoint)
+
+    # Streamed responses have no length until they are sent.
+    if not response.is_streamed:
+        metrics.size.observe(
+            response.calculate_content_length() or 0, endpoint
+        )
+    return response
+
+def finish_request(e=None):
+    if 'metrics_start' in g:
+        current_app.extensions['metrics'].in_progress.dec()
+
+
+def metrics_view():
+    metrics = current_app.extensions['metrics']
+    return current_app.response_class(
+        render(metrics.all()),
+        mimetype='text/plain; version=0.0.4',
+    )
+
+
+# Register the hooks and the /metrics endpoint.
+def init_app(app):
+    app.extensions['metrics'] = Metrics(app)
+    app.before_request(start_request)
+    app.after_request(record_response)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,288 @@
+"""
+Versioned schema migrations.
+init_db builds a new database from schema.sql, which drops everything
+first. Existing databases are brought up to date by `flask db-upgrade`
+instead, which runs the migrations below that are not yet recorded in the
+schema_version table. `flask db-status` lists them.
+
+Every migration can safely run against a database that already has some
+of its changes (IF NOT EXISTS, column checks), so databases from before the
+schema_version table existed simply run them all.
+
+To change the schema, update schema.sql for new databases AND append a
+migration here for existing ones.
+"""
+
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from flaskr.db import denormalize_authors, get_db
+
+
+# Whether a table has a column, and whether a table, index or trigger exists.
+def has_column(db, table, column):
+    return any(
+        row['name'] == column
+        for row in db.execute(f'PRAGMA table_info({table})')
+    )
+
+def has_object(db, name):
+    return db.execute(
+        'SELECT 1 FROM sqlite_master WHERE name = ?', (name,)
+    ).fetchone() is not None
+
+def add_column(db, table, column, definition):
+    if not has_column(db, table, column):
+        db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        db.commit()
+
+# Build an index. SQLite builds an index in one CREATE INDEX statement,
+# which reads the whole table and holds the write lock until it is done -
+# writers wait (up to busy_timeout) for the whole build. WAL mode keeps
+# readers going throughout. On a big table, run the migration when few
+# people are writing.
+def create_index(db, name, table, columns):
+    db.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+    db.commit()
+
+# Marks a migration that builds an index, so db-upgrade can say it held
+# the write lock.
+def builds_index(migrate):
+    migrate.builds_index = True
+    return migrate
+
+
+# The migrations. Each is a function taking the connection and the batch
+# size for steps that work through a table.
+
+def tutorial_schema(db, batch_size):
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS user (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          username TEXT UNIQUE NOT NULL,
+          password TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS post (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          author_id INTEGER NOT NULL,
+          created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          title TEXT NOT NULL,
+          body TEXT NOT NULL,
+          FOREIGN KEY (author_id) REFERENCES user (id)
+        );
+    """)
+
+@builds_index
+def post_created_index(db, batch_size):
+    create_index(db, 'post_created_id', 'post', 'created, id')
+
+def post_revision(db, batch_size):
+    add_column(db, 'post', 'revision', 'INTEGER NOT NULL DEFAULT 0')
+
+def blog_state(db, batch_size):
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS blog_state (
+          id INTEGER PRIMARY KEY CHECK (id = 1),
+          version INTEGER NOT NULL DEFAULT 0,
+          modified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT OR IGNORE INTO blog_state (id) VALUES (1);
+        CREATE TRIGGER IF NOT EXISTS post_insert_state AFTER INSERT ON post
+        BEGIN
+          UPDATE blog_state
+          SET version = version + 1, modified = CURRENT_TIMESTAMP;
+        END;
+        CREATE TRIGGER IF NOT EXISTS post_update_state AFTER UPDATE ON post
+        BEGIN
+          UPDATE blog_state
+          SET version = version + 1, modified = CURRENT_TIMESTAMP;
+        END;
+        CREATE TRIGGER IF NOT EXISTS post_delete_state AFTER DELETE ON post
+        BEGIN
+          UPDATE blog_state
+          SET version = version + 1, modified = CURRENT_TIMESTAMP;
+        END;
+    """)
+
+def full_text_search(db, batch_size):
+    if has_object(db, 'post_fts'):
+        return
+    db.executescript("""
+        CREATE VIRTUAL TABLE post_fts USING fts5(
+          title, body, content='post', content_rowid='id',
+          tokenize='porter unicode61'
+        );
+        CREATE TRIGGER IF NOT EXISTS post_insert_fts AFTER INSERT ON post
+        BEGIN
+          INSERT INTO post_fts (rowid, title, body)
+          VALUES (NEW.id, NEW.title, NEW.body);
+        END;
+        CREATE TRIGGER IF NOT EXISTS post_delete_fts AFTER DELETE ON post
+        BEGIN
+          INSERT INTO post_fts (post_fts, rowid, title, body)
+          VALUES ('delete', OLD.id, OLD.title, OLD.body);
+        END;
+        CREATE TRIGGER IF NOT EXISTS post_update_fts
+        AFTER UPDATE OF title, body ON post BEGIN
+          INSERT INTO post_fts (post_fts, rowid, title, body)
+          VALUES ('delete', OLD.id, OLD.title, OLD.body);
+          INSERT INTO post_fts (rowid, title, body)
+          VALUES (NEW.id, NEW.title, NEW.body);
+        END;
+        INSERT INTO post_fts (post_fts) VALUES ('rebuild');
+    """)
+
+def author_username(db, batch_size):
+    denormalize_authors(db, batch_size)
+
+@builds_index
+def post_author_index(db, batch_size):
+    create_index(
+        db, 'post_author_created', 'post', 'author_id, created, id'
+    )
+
+# Adds user.post_count and its triggers, then counts each user's posts a
+# batch of users at a time - one index seek per user.
+def author_post_counts(db, batch_size):
+    add_column(db, 'user', 'post_count', 'INTEGER NOT NULL DEFAULT 0')
+    db.executescript("""
+        CREATE TRIGGER IF NOT EXISTS post_insert_count AFTER INSERT ON post
+        BEGIN
+          UPDATE user SET post_count = post_count + 1
+          WHERE id = NEW.author_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS post_delete_count AFTER DELETE ON post
+        BEGIN
+          UPDATE user SET post_count = post_count - 1
+          WHERE id = OLD.author_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS post_update_count
+        AFTER UPDATE OF author_id ON post BEGIN
+          UPDATE user SET post_count = post_count - 1
+          WHERE id = OLD.author_id;
+          UPDATE user SET post_count = post_count + 1
+          WHERE id = NEW.author_id;
+        END;
+    """)
+
+    last = db.execute('SELECT MAX(id) FROM user').fetchone()[0] or 0
+    for start in range(0, last, batch_size):
+        db.execute(
+            'UPDATE user SET post_count = ('
+            '  SELECT COUNT(*) FROM post WHERE author_id = user.id'
+            ') WHERE id > ? AND id <= ?',
+            (start, start + batch_size)
+        )
+        db.commit()
+
+
+# (version, name, function), in the order they are applied. Never change
+# or renumber a migration that has been released - add a new one.
+MIGRATIONS = [
+    (1, 'tutorial schema', tutorial_schema),
+    (2, 'post created index', post_created_index),
+    (3, 'post revision', post_revision),
+    (4, 'blog state', blog_state),
+    (5, 'full-text search', full_text_search),
+    (6, 'denormalized author', author_username),
+    (7, 'post author index', post_author_index),
+    (8, 'author post counts', author_post_counts),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def ensure_version_table(db):
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        '  version INTEGER PRIMARY KEY,'
+        '  name TEXT NOT NULL,'
+        '  applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP'
+        ')'
+    )
+
+# Versions applied to the database, mapped to when.
+def applied_versions(db):
+    ensure_version_table(db)
+    return {
+        row['version']: row['applied']
+        for row in db.execute('SELECT version, applied FROM schema_version')
+    }
+
+# Record every migration as applied, for a database made from schema.sql.
+def stamp(db):
+    ensure_version_table(db)
+    db.executemany(
+        'INSERT OR IGNORE INTO schema_version (version, name) VALUES (?, ?)',
+        [(version, name) for version, name, _ in MIGRATIONS]
+    )
+    db.commit()
+
+# Apply the pending migrations up to version `to` (default: all of them),
+# then ANALYZE so the query planner knows about new indexes. Returns the
+# (version, name, seconds) of each migration applied.
+def upgrade(db, to=LATEST, batch_size=10000):
+    applied = applied_versions(db)
+    done = []
+    for version, name, migrate in MIGRATIONS:
+        if version > to or version in applied:
+            continue
+        start = time.perf_counter()
+        migrate(db, batch_size)
+        db.execute(
+            'INSERT INTO schema_version (version, name) VALUES (?, ?)',
+            (version, name)
+        )
+        db.commit()
+        done.append((version, name, time.perf_counter() - start))
+
+    if done:
+        # analysis_limit samples each index instead of reading all of it,
+        # which keeps ANALYZE quick on big tables.
+        db.execute('PRAGMA analysis_limit = 1000')
+        db.execute('ANALYZE')
+        db.commit()
+    return done
+
+
+@click.command('db-upgrade')
+@click.option('--to', type=int, default=LATEST, show_default=True,
+              help='Version to upgrade to.')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Rows per batch when a migration works through a table.')
+@with_appcontext
+def db_upgrade_command(to, batch_size):
+    """Apply pending schema migrations.
+
+    Migrations that build an index hold the write lock for the whole
+    build - writers wait until it finishes.
+    """
+    done = upgrade(get_db(), to, batch_size)
+    migrations = {version: migrate for version, _, migrate in MIGRATIONS}
+    for version, name, seconds in done:
+        locked = ', write lock held to build the index' \
+            if getattr(migrations[version], 'builds_index', False) else ''
+        click.echo(f'Applied {version} {name} ({seconds:.2f}s{locked}).')
+    if done:
+        click.echo('Analyzed the database.')
+    else:
+        click.echo('The database is up to date.')
+
+
+@click.command('db-status')
+@with_appcontext
+def db_status_command():
+    """List the schema migrations and which are applied."""
+    applied = applied_versions(get_db())
+    current = max(applied, default=0)
+    click.echo(f'Database is at version {current} of {LATEST}.')
+    for version, name, _ in MIGRATIONS:
+        state = f'applied {applied[version]}' if version in applied \
+            else 'pending'
+        click.echo(f'{version:>4} {name:<24} {state}')
+
+
+def init_app(app):
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(db_status_command)
@@ -0,0 +1,176 @@
+"""
+SQLite connection pool.
+Opening a connection means opening the file, reading the schema and running
+the connection setup every time. The pool keeps a few set-up connections
+around per process and hands them out to requests instead.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+# Raised when every pooled connection stays busy for longer than the timeout.
+class PoolTimeout(Exception):
+    pass
+
+
+# The object handed out to a request. Behaves like the sqlite3 connection it
+# wraps, but close() gives the connection back to the pool instead of closing
+# it. After that any use raises the same error as a really closed connection.
+class PooledConnection(object):
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    # Everything not defined here (execute, commit, IntegrityError, ...) is
+    # passed straight through to the real connection.
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError(
+                'Cannot operate on a closed database.'
+            )
+        return getattr(self._conn, name)
+
+    # Special methods skip __getattr__, so `with db:` needs these.
+    def __enter__(self):
+        self.__getattr__('__enter__')()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+
+# Bounded, thread-safe pool of connections for one database file.
+# connect is a function that opens and sets up a new connection.
+class ConnectionPool(object):
+    def __init__(self, connect, size=5, timeout=10.0):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        # Idle connections, used last in first out to keep the warmest ones.
+        self._idle = []
+        # Number of connections opened, idle or handed out.
+        self._opened = 0
+        self._lock = threading.Condition()
+        # Connections cannot be shared with a forked child process.
+        self._pid = os.getpid()
+        # Counters for monitoring.
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.discarded = 0
+
+    # Forget connections inherited from the parent process after a fork.
+    # They belong to the parent, so they are dropped rather than closed.
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._opened = 0
+
+    # Take a connection out of the pool, opening a new one if the pool is
+    # not full yet, or waiting for one to be released if it is.
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                self._check_pid()
+                conn = None
+                if not self._idle and self._opened >= self.size:
+                    self.waits += 1
+                while not self._idle and self._opened >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._lock.wait(remaining):
+                        self.timeouts += 1
+                        raise PoolTimeout(
+                            f'No database connection free after'
+                            f' {self.timeout} seconds.'
+                        )
+                if self._idle:
+                    conn = self._idle.pop()
+                    self.hits += 1
+                else:
+                    # Reserve the slot now, open the file outside the lock.
+                    self._opened += 1
+                    self.misses += 1
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+
+            # Health check - a connection that cannot run a trivial query is
+            # thrown away and we try again.
+            try:
+                conn.execute('SELECT 1').fetchone()
+            except sqlite3.Error:
+                self._discard(conn)
+                continue
+            return conn
+
+    # Give a connection back. Uncommitted work is rolled back, just as
+    # closing the connection would have done.
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._idle.append(conn)
+            self._lock.notify()
+
+    # Close a broken connection and free its slot.
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._forget()
+        with self._lock:
+            self.discarded += 1
+
+    def _forget(self):
+        with self._lock:
+            self._opened -= 1
+            self._lock.notify()
+
+    # Hand out a connection wrapped so that close() returns it to the pool.
+    def connection(self):
+        return PooledConnection(self, self.acquire())
+
+    # Close all idle connections, e.g. before deleting the database file.
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'opened': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._opened - len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+            }
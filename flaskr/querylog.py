@@ -0,0 +1,358 @@
+"""
+Query instrumentation.
+get_db wraps its connection so every statement is timed and its rows
+counted. At the end of each app context the statements are added to the
+per-process totals (by normalized statement), and any slower than
+SLOW_QUERY_MS are written to the slow-query log with their query plan.
+Each response gets a Server-Timing header with the request's DB time,
+query count and template render time, which browser dev tools display.
+
+Totals are saved to QUERY_STATS_DIR every QUERY_STATS_FLUSH seconds, one
+file per worker process, and `flask query-stats` adds them all up.
+"""
+
+import functools
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+import click
+from flask import (
+    before_render_template, current_app, g, has_request_context, request,
+    template_rendered
+)
+from flask.cli import with_appcontext
+from flask.signals import signals_available
+
+# String and number literals, replaced by ? when normalizing.
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r'\s+')
+
+
+# Reduce a statement to its shape, so queries differing only in their
+# literal values are counted together. The same few strings come round
+# again and again, so the results are cached.
+@functools.lru_cache(maxsize=1024)
+def normalize(sql):
+    return _SPACE.sub(' ', _LITERALS.sub('?', sql)).strip()
+
+
+# One executed statement. Rows and time keep adding up while the cursor
+# is being read, because SQLite does most of a SELECT's work during fetch.
+class QueryRecord(object):
+    __slots__ = ('sql', 'params', 'elapsed', 'rows')
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.elapsed = 0.0
+        self.rows = 0
+
+
+# Cursor wrapper that times fetches and counts the rows returned.
+class InstrumentedCursor(object):
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._record.elapsed += time.perf_counter() - start
+        if row is not None:
+            self._record.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        if size is None:
+            rows = self._cursor.fetchmany()
+        else:
+            rows = self._cursor.fetchmany(size)
+        self._record.elapsed += time.perf_counter() - start
+        self._record.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._record.elapsed += time.perf_counter() - start
+        self._record.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+
+# Connection wrapper that records every statement run through it.
+# Everything else is passed through to the wrapped connection.
+class InstrumentedConnection(object):
+    def __init__(self, conn):
+        self._wrapped = conn
+        self.records = []
+        # Remembered now - the request is gone by the time close_db runs.
+        self.path = request.path if has_request_context() else None
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __enter__(self):
+        self._wrapped.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapped.__exit__(*exc_info)
+
+    def _run(self, method, sql, params, keep_params=True):
+        record = QueryRecord(sql, params if keep_params else None)
+        start = time.perf_counter()
+        try:
+            cursor = method(sql, params)
+        finally:
+            record.elapsed = time.perf_counter() - start
+            self.records.append(record)
+        # rowcount is the number of rows changed, -1 for a SELECT.
+        if cursor.rowcount > 0:
+            record.rows = cursor.rowcount
+        return InstrumentedCursor(cursor, record)
+
+    def execute(self, sql, params=()):
+        return self._run(self._wrapped.execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        # The parameters are an iterator, used up by now - no plan later.
+        return self._run(
+            self._wrapped.executemany, sql, seq_of_params, keep_params=False
+        )
+
+    def executescript(self, script):
+        record = QueryRecord(script, None)
+        start = time.perf_counter()
+        try:
+            return self._wrapped.executescript(script)
+        finally:
+            record.elapsed = time.perf_counter() - start
+            self.records.append(record)
+
+
+# Per-process totals by normalized statement: count, total and max time
+# (seconds) and rows.
+class QueryStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self.last_flush = time.monotonic()
+
+    def add(self, records):
+        with self._lock:
+            for record in records:
+                stats = self._data.setdefault(
+                    normalize(record.sql), [0, 0.0, 0.0, 0]
+                )
+                stats[0] += 1
+                stats[1] += record.elapsed
+                stats[2] = max(stats[2], record.elapsed)
+                stats[3] += record.rows
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                statement: {
+                    'count': count, 'total': total, 'max': max_, 'rows': rows
+                }
+                for statement, (count, total, max_, rows) in self._data.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def get_stats(app=None):
+    app = app or current_app
+
+    if 'query_stats' not in app.extensions:
+        app.extensions['query_stats'] = QueryStats()
+
+    return app.extensions['query_stats']
+
+
+# Add the totals of several snapshots together.
+def merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for statement, stats in snapshot.items():
+            total = merged.setdefault(
+                statement, {'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0}
+            )
+            total['count'] += stats['count']
+            total['total'] += stats['total']
+            total['max'] = max(total['max'], stats['max'])
+            total['rows'] += stats['rows']
+    return merged
+
+
+# Called by close_db before the connection goes back to the pool: add the
+# statements to the totals and log the slow ones.
+def record_queries(db):
+    app = current_app._get_current_object()
+    stats = get_stats(app)
+    stats.add(db.records)
+
+    threshold = app.config['SLOW_QUERY_MS'] / 1000
+    if app.config['SLOW_QUERY_LOG']:
+        for record in db.records:
+            if record.elapsed >= threshold:
+                log_slow_query(app, db, record)
+
+    if (app.config['QUERY_STATS_DIR']
+            and time.monotonic() - stats.last_flush
+            >= app.config['QUERY_STATS_FLUSH']):
+        flush_stats(app)
+
+
+_log_lock = threading.Lock()
+
+# Append a slow statement to the slow-query log as a JSON line, with the
+# plan SQLite chose for it. The parameters are only used for the plan, not
+# logged - they can hold passwords.
+def log_slow_query(app, db, record):
+    plan = None
+    if record.params is not None:
+        try:
+            plan = [
+                row[3] for row in db._wrapped.execute(
+                    'EXPLAIN QUERY PLAN ' + record.sql, record.params
+                ).fetchall()
+            ]
+        except Exception:
+            plan = None
+
+    entry = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'ms': round(record.elapsed * 1000, 3),
+        'rows': record.rows,
+        'statement': normalize(record.sql),
+        'plan': plan,
+        'path': db.path,
+    }
+    with _log_lock, open(app.config['SLOW_QUERY_LOG'], 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+# Save this process's totals for `flask query-stats`. Written to a
+# temporary file and renamed, so readers never see half a file.
+def flush_stats(app):
+    stats = get_stats(app)
+    stats.last_flush = time.monotonic()
+    directory = app.config['QUERY_STATS_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(stats.snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+
+# Template render time. Templates rendered from inside another render (none
+# today, but includes via render_template would) only count once.
+def _render_started(app, template, context, **extra):
+    g.setdefault('render_starts', []).append(time.perf_counter())
+
+def _render_finished(app, template, context, **extra):
+    starts = g.get('render_starts')
+    if starts:
+        elapsed = time.perf_counter() - starts.pop()
+        if not starts:
+            g.render_time = g.get('render_time', 0.0) + elapsed
+
+
+def start_request():
+    g.request_start = time.perf_counter()
+
+# The queries this request ran, on the primary and on a replica, or None
+# when neither connection was instrumented.
+def request_records():
+    records = None
+    for name in ('db', 'read_db'):
+        db_records = getattr(g.get(name), 'records', None)
+        if db_records is not None:
+            records = (records or []) + db_records
+    return records
+
+# Summarize the request in a Server-Timing header.
+def add_server_timing(response):
+    records = request_records() or ()
+    db_time = sum(record.elapsed for record in records)
+    total = time.perf_counter() - g.get('request_start', time.perf_counter())
+    response.headers['Server-Timing'] = (
+        f'db;dur={db_time * 1000:.2f};desc="{len(records)} queries", '
+        f"render;dur={g.get('render_time', 0.0) * 1000:.2f}, "
+        f'total;dur={total * 1000:.2f}'
+    )
+    return response
+
+
+# Show the busiest statements across all workers.
+@click.command('query-stats')
+@click.option(
+    '--sort', default='total', show_default=True,
+    type=click.Choice(('total', 'count', 'mean', 'max', 'rows'))
+)
+@click.option('--limit', default=20, show_default=True)
+@click.option('--reset', is_flag=True, help='Delete the saved totals.')
+@with_appcontext
+def query_stats_command(sort, limit, reset):
+    """Show query totals by statement, collected from all workers."""
+    directory = current_app.config['QUERY_STATS_DIR']
+    paths = glob.glob(os.path.join(directory, '*.json')) if directory else []
+
+    if reset:
+        for path in paths:
+            os.unlink(path)
+        get_stats().clear()
+        click.echo(f'Deleted {len(paths)} saved totals.')
+        return
+
+    snapshots = [get_stats().snapshot()]
+    for path in paths:
+        with open(path) as f:
+            snapshots.append(json.load(f))
+    merged = merge(snapshots)
+
+    def key(item):
+        stats = item[1]
+        if sort == 'mean':
+            return stats['total'] / stats['count']
+        return stats[sort]
+
+    click.echo(f"{'count':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"
+               f" {'rows':>8}  statement")
+    for statement, stats in sorted(merged.items(), key=key, reverse=True)[
+            :limit]:
+        click.echo(
+            f"{stats['count']:>8} {stats['total'] * 1000:>10.2f}"
+            f" {stats['total'] * 1000 / stats['count']:>9.3f}"
+            f" {stats['max'] * 1000:>9.3f} {stats['rows']:>8}  {statement}"
+        )
+
+
+# Register the request hooks, template signals and CLI command.
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(add_server_timing)
+    # Render timing needs blinker for Flask's signals, it is left out
+    # without it. Signals hold weak references - these are module functions.
+    if signals_available:
+        before_render_template.connect(_render_started, app)
+        template_rendered.connect(_render_finished, app)
+    app.cli.add_command(query_stats_command)
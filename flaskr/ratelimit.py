@@ -0,0 +1,211 @@
+"""
+Rate limiting for the auth endpoints.
+Logins and sign-ups each cost a password hash, so bursts of them are
+turned away with 429 Too Many Requests before the request reaches the
+database or the hasher. Each limit is a token bucket: it holds up to
+`capacity` requests and refills at `capacity` per `seconds`, so short
+bursts pass and sustained floods do not.
+
+Buckets are kept in this process (RATELIMIT_STORAGE = 'memory'), or in a
+small SQLite file shared by all workers on the machine ('sqlite'), so a
+limit holds however many workers there are. A bucket that has filled up
+again is the same as no bucket, so the file is swept of those every
+RATELIMIT_SWEEP_INTERVAL seconds - otherwise every username tried in a
+credential-stuffing run would stay in it for good.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+from flaskr.db import connect
+from flaskr.pool import ConnectionPool
+from flaskr.sessions import Sweeper
+
+
+# Raised when a bucket is empty. Flask turns it into a 429 response with a
+# Retry-After header.
+class RateLimited(TooManyRequests):
+    description = 'Too many attempts, please try again later.'
+
+
+# Refill a bucket that held `tokens` at `updated` up to `now`, then try to
+# take a token. Returns the new number of tokens and the seconds to wait
+# until a token is available (0 when one was taken).
+def refill_and_take(tokens, updated, now, capacity, seconds):
+    rate = capacity / seconds
+    if tokens is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+# Buckets in a dict for this process, least recently used first. At most
+# maxsize are kept - a forgotten bucket simply starts full again.
+class MemoryBuckets(object):
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, seconds):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (None, None))
+            tokens, wait = refill_and_take(
+                tokens, updated, now, capacity, seconds
+            )
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Buckets in a SQLite file, shared by every worker process that opens it.
+# Each take is one short write transaction. Every row also records when
+# its bucket will be full again, for sweep().
+class SQLiteBuckets(object):
+    PRAGMAS = {
+        'busy_timeout': 1000,
+        'journal_mode': 'WAL',
+        # Losing the last few takes in a power cut does not matter.
+        'synchronous': 'OFF',
+    }
+
+    def __init__(self, path, size=5, timeout=10.0):
+        self._pool = ConnectionPool(
+            lambda: connect(path, self.PRAGMAS), size, timeout
+        )
+        db = self._pool.connection()
+        try:
+            columns = [
+                row[1] for row in db.execute('PRAGMA table_info(bucket)')
+            ]
+            # Files from before full_at only hold buckets, which may as
+            # well start full again.
+            if columns and 'full_at' not in columns:
+                db.execute('DROP TABLE bucket')
+            db.executescript(
+                'CREATE TABLE IF NOT EXISTS bucket ('
+                '  key TEXT PRIMARY KEY, tokens REAL, updated REAL,'
+                '  full_at REAL NOT NULL'
+                ') WITHOUT ROWID;'
+                'CREATE INDEX IF NOT EXISTS bucket_full_at'
+                '  ON bucket (full_at);'
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def take(self, key, capacity, seconds):
+        now = time.time()
+        db = self._pool.connection()
+        try:
+            # IMMEDIATE takes the write lock up front, so two workers cannot
+            # both read the same last token.
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute(
+                'SELECT tokens, updated FROM bucket WHERE key = ?', (key,)
+            ).fetchone() or (None, None)
+            tokens, wait = refill_and_take(
+                row[0], row[1], now, capacity, seconds
+            )
+            full_at = now + (capacity - tokens) * seconds / capacity
+            db.execute(
+                'INSERT OR REPLACE INTO bucket (key, tokens, updated, full_at)'
+                ' VALUES (?, ?, ?, ?)',
+                (key, tokens, now, full_at)
+            )
+            db.commit()
+        finally:
+            db.close()
+        return wait
+
+    # Delete the buckets that are full again by `now` - a missing bucket
+    # starts full. Returns how many there were.
+    def sweep(self, now):
+        db = self._pool.connection()
+        try:
+            count = db.execute(
+                'DELETE FROM bucket WHERE full_at <= ?', (now,)
+            ).rowcount
+            db.commit()
+        finally:
+            db.close()
+        return count
+
+    def __len__(self):
+        db = self._pool.connection()
+        try:
+            return db.execute('SELECT COUNT(*) FROM bucket').fetchone()[0]
+        finally:
+            db.close()
+
+    def close(self):
+        self._pool.close()
+
+
+# Client address, and the username being logged in to.
+def by_ip():
+    return request.remote_addr
+
+def by_username():
+    return request.form.get('username', '').strip().lower() or None
+
+# The limits checked for each endpoint, as (limit name, key function).
+# Limit names are looked up in the RATE_LIMITS config.
+ENDPOINTS = {
+    'auth.login': (('login_ip', by_ip), ('login_user', by_username)),
+    'auth.register': (('register_ip', by_ip),),
+}
+
+
+def get_buckets(app=None):
+    app = app or current_app
+
+    if 'ratelimit' not in app.extensions:
+        if app.config['RATELIMIT_STORAGE'] == 'sqlite':
+            buckets = SQLiteBuckets(app.config['RATELIMIT_DATABASE'])
+            app.extensions['ratelimit_sweeper'] = Sweeper(
+                buckets, app.config['RATELIMIT_SWEEP_INTERVAL'],
+                name='ratelimit-sweeper'
+            )
+        else:
+            buckets = MemoryBuckets(app.config['RATELIMIT_SIZE'])
+        app.extensions['ratelimit'] = buckets
+
+    if 'ratelimit_sweeper' in app.extensions:
+        app.extensions['ratelimit_sweeper'].start()
+    return app.extensions['ratelimit']
+
+
+# Runs before the auth hooks and views, so a limited request never reaches
+# the database. Only form posts are counted - showing the forms is free.
+def check_rate_limits():
+    limits = ENDPOINTS.get(request.endpoint)
+    if limits is None or request.method != 'POST':
+        return
+
+    config = current_app.config['RATE_LIMITS']
+    for name, key_func in limits:
+        rate = config.get(name)
+        key = key_func()
+        if rate is None or key is None:
+            continue
+        wait = get_buckets().take(f'{name}:{key}', *rate)
+        if wait:
+            raise RateLimited(retry_after=math.ceil(wait))
+
+
+def init_app(app):
+    app.before_request(check_rate_limits)
@@ -0,0 +1,179 @@
+"""
+Read-only replicas of the SQLite database.
+Each replica is a copy of the primary database file, refreshed with the
+SQLite backup API every few seconds by a background thread (and, if asked,
+soon after every write). Read-only views borrow a connection to one of the
+replicas, so long reads never compete with writers on the primary file.
+
+A replica is only as fresh as its last copy. A visitor who has just
+written is sent to the primary until a copy taken after their write has
+finished, so they always see their own changes.
+
+Every worker process runs a sync thread, but the copies are shared: a copy
+is made under a lock file, and the time it started is kept as the mtime of
+a stamp file next to the primary. A worker finding a recent enough copy
+there skips its own, so there is one copy per interval however many
+workers there are, and every worker knows how fresh the replicas are.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # No lock file on Windows - run a single worker, or set
+    # REPLICA_SYNC_INTERVAL to None and use `flask sync-replicas`.
+    fcntl = None
+
+from flaskr.pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaSet(object):
+    # primary is the path of the primary database, paths those of its
+    # replicas. connect(path, pragmas) opens a set-up connection.
+    def __init__(self, primary, paths, connect, pragmas=None, size=5,
+                 timeout=10.0, interval=None):
+        self.primary = primary
+        self.paths = list(paths)
+        self.interval = interval
+        self._connect = connect
+        self._pragmas = dict(pragmas or {})
+        # Replica connections must never write - the next copy would
+        # silently throw the change away.
+        read_pragmas = dict(self._pragmas, query_only='ON')
+        self._pools = {
+            path: ConnectionPool(
+                lambda path=path: connect(path, read_pragmas), size, timeout
+            )
+            for path in self.paths
+        }
+        # Shared by every process using this primary.
+        self.lock_path = primary + '-replicas.lock'
+        self.stamp_path = primary + '-replicas.synced'
+        # Copies made by this process.
+        self.syncs = 0
+        # time.time() of the latest write waiting for a copy, or None.
+        self._requested = None
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    # time.time() at the start of the last complete copy by any process,
+    # None before the first. Writes committed before then are in every
+    # replica.
+    @property
+    def synced_at(self):
+        try:
+            return os.stat(self.stamp_path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    # Copy the primary onto every replica, unless a copy started after
+    # newer_than (a time.time() value) already has. Returns whether this
+    # call copied. The backup API copies page by page and replica readers
+    # in WAL mode keep going meanwhile, seeing the new copy from their next
+    # transaction.
+    def sync(self, newer_than=None):
+        with self._sync_lock, open(self.lock_path, 'a') as lock:
+            # Waits while another process copies - its copy may do.
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            synced_at = self.synced_at
+            if newer_than is not None and synced_at is not None \
+                    and synced_at >= newer_than:
+                return False
+
+            started = time.time()
+            source = self._connect(self.primary, self._pragmas)
+            try:
+                for path in self.paths:
+                    target = self._connect(path, self._pragmas)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+
+            with open(self.stamp_path, 'a'):
+                pass
+            os.utime(self.stamp_path, (started, started))
+            self.syncs += 1
+            return True
+
+    # Whether the replicas already hold a write made at written_at (a
+    # time.time() value, or None for a visitor who has not written).
+    def fresh_for(self, written_at):
+        if self.synced_at is None:
+            return False
+        return written_at is None or written_at < self.synced_at
+
+    # Borrow a connection to a random replica.
+    def connection(self):
+        return self._pools[random.choice(self.paths)].connection()
+
+    # Ask the sync thread for a copy holding everything written until now,
+    # instead of waiting for the next interval.
+    def request_sync(self):
+        self._requested = time.time()
+        self.start()
+        self._wake.set()
+
+    # Start the sync thread, unless it is running already. Threads do not
+    # survive a fork, so a worker process starts its own on first use.
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='replica-sync', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        # The first copy is made straight away, unless another process has
+        # made one within the interval (or at all, without an interval).
+        while not self._stop.is_set():
+            self._wake.clear()
+            if self.interval is None:
+                newer_than = 0
+            else:
+                newer_than = time.time() - self.interval
+            requested, self._requested = self._requested, None
+            if requested is not None:
+                newer_than = max(newer_than, requested)
+            try:
+                self.sync(newer_than)
+            except Exception:
+                logger.exception('Copying to the replicas failed.')
+            self._wake.wait(self.interval)
+
+    # Stop the sync thread and close the idle replica connections.
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not \
+                threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        for pool in self._pools.values():
+            pool.close()
+
+    def stats(self):
+        return {
+            'replicas': len(self.paths),
+            'syncs': self.syncs,
+            'lag': None if self.synced_at is None
+            else time.time() - self.synced_at,
+        }
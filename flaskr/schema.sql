@@ -4,12 +4,18 @@
 -- Drop the tables if they exist already to replace with our correct versions.
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
+DROP TABLE IF EXISTS blog_state;
+DROP TABLE IF EXISTS post_fts;
+DROP TABLE IF EXISTS schema_version;
 
 -- Create the tables how we wish.
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   username TEXT UNIQUE NOT NULL,
-  password TEXT NOT NULL
+  password TEXT NOT NULL,
+  -- Number of posts by the user, kept up to date by the post_*_count
+  -- triggers so author pages never have to count them.
+  post_count INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE post (
@@ -18,5 +24,106 @@ CREATE TABLE post (
   created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   title TEXT NOT NULL,
   body TEXT NOT NULL,
+  -- Bumped on every update, so caches can tell an old copy from a new one.
+  revision INTEGER NOT NULL DEFAULT 0,
+  -- Copy of the author's username, so reads can skip the join with user
+  -- (DENORMALIZED_AUTHOR config). Usernames never change once registered.
+  author_username TEXT,
   FOREIGN KEY (author_id) REFERENCES user (id)
 );
+
+-- Composite index for the keyset paginated index page. Pages are read in
+-- (created, id) order, so SQLite can seek straight to the cursor.
+CREATE INDEX post_created_id ON post (created, id);
+
+-- Posts by author in (created, id) order, for the keyset paginated author
+-- pages - one author's page costs the same however many posts they have.
+CREATE INDEX post_author_created ON post (author_id, created, id);
+
+-- Migrations applied to this database, see migrations.py. init-db records
+-- every migration, because this file is always the latest schema.
+CREATE TABLE schema_version (
+  version INTEGER PRIMARY KEY,
+  name TEXT NOT NULL,
+  applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- A single row that changes whenever any post does. Pages can compare its
+-- version against the client's copy (ETag) without reading the posts.
+CREATE TABLE blog_state (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL DEFAULT 0,
+  modified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO blog_state (id) VALUES (1);
+
+-- Keep blog_state up to date however the posts are written.
+CREATE TRIGGER post_insert_state AFTER INSERT ON post BEGIN
+  UPDATE blog_state SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER post_update_state AFTER UPDATE ON post BEGIN
+  UPDATE blog_state SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER post_delete_state AFTER DELETE ON post BEGIN
+  UPDATE blog_state SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+-- Full-text index over post titles and bodies for the search page.
+-- External content table: the text itself stays in post, the index only
+-- stores tokens, and the triggers below keep the two in step.
+CREATE VIRTUAL TABLE post_fts USING fts5(
+  title,
+  body,
+  content='post',
+  content_rowid='id',
+  tokenize='porter unicode61'
+);
+
+CREATE TRIGGER post_insert_fts AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts (rowid, title, body)
+  VALUES (NEW.id, NEW.title, NEW.body);
+END;
+
+CREATE TRIGGER post_delete_fts AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body)
+  VALUES ('delete', OLD.id, OLD.title, OLD.body);
+END;
+
+CREATE TRIGGER post_update_fts AFTER UPDATE OF title, body ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body)
+  VALUES ('delete', OLD.id, OLD.title, OLD.body);
+  INSERT INTO post_fts (rowid, title, body)
+  VALUES (NEW.id, NEW.title, NEW.body);
+END;
+
+-- Fill in author_username for posts inserted without it (bulk loads, SQL
+-- by hand) and when a post changes author. blog.create sets it directly.
+CREATE TRIGGER post_insert_author AFTER INSERT ON post
+WHEN NEW.author_username IS NULL BEGIN
+  UPDATE post SET author_username = (
+    SELECT username FROM user WHERE id = NEW.author_id
+  ) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER post_update_author AFTER UPDATE OF author_id ON post BEGIN
+  UPDATE post SET author_username = (
+    SELECT username FROM user WHERE id = NEW.author_id
+  ) WHERE id = NEW.id;
+END;
+
+-- Keep user.post_count up to date however the posts are written.
+CREATE TRIGGER post_insert_count AFTER INSERT ON post BEGIN
+  UPDATE user SET post_count = post_count + 1 WHERE id = NEW.author_id;
+END;
+
+CREATE TRIGGER post_delete_count AFTER DELETE ON post BEGIN
+  UPDATE user SET post_count = post_count - 1 WHERE id = OLD.author_id;
+END;
+
+CREATE TRIGGER post_update_count AFTER UPDATE OF author_id ON post BEGIN
+  UPDATE user SET post_count = post_count - 1 WHERE id = OLD.author_id;
+  UPDATE user SET post_count = post_count + 1 WHERE id = NEW.author_id;
+END;
@@ -0,0 +1,317 @@
+"""
+Server-side sessions.
+Flask keeps the whole session in a signed cookie: it travels to the
+browser and back with every request, and its signature is checked every
+time. With SESSION_STORAGE = 'memory' (one process) or 'sqlite' (every
+worker on the machine), sessions are kept on the server instead and the
+cookie only holds a random session id. The session also carries the
+logged in user's row (see auth.load_logged_in_user), so most requests
+need no user query either.
+
+A session expires PERMANENT_SESSION_LIFETIME after it was last saved.
+Expired sessions are never loaded, and a background thread deletes them
+in bulk every SESSION_SWEEP_INTERVAL seconds rather than on requests.
+"""
+
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from flaskr.db import connect
+from flaskr.pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+# A session kept on the server, known to the browser only by its id.
+# sid is None until it is first saved, expires the time.time() its record
+# expires at.
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, data=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(data, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+        self.accessed = False
+        # Set by clear() - the session is saved under a new id.
+        self.rotated = False
+
+    # As with Flask's cookie session, reading the session marks the
+    # response Vary: Cookie.
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    # Login and logout clear the session, which also drops its id, so an
+    # id known to someone else before a login is useless after it.
+    def clear(self):
+        super().clear()
+        self.rotated = True
+
+
+# Sessions in a dict for this process, least recently used first. At most
+# maxsize are kept - a forgotten session means logging in again.
+class MemorySessions(object):
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        # sid -> (expires, data).
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    # The (expires, data) of an unexpired session, or None.
+    def load(self, sid, now):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry[0] <= now:
+                return None
+            self._sessions.move_to_end(sid)
+            return entry[0], dict(entry[1])
+
+    def save(self, sid, data, expires):
+        with self._lock:
+            self._sessions[sid] = (expires, dict(data))
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    # Delete every session expired by `now`. Returns how many there were.
+    def sweep(self, now):
+        with self._lock:
+            expired = [
+                sid for sid, (expires, data) in self._sessions.items()
+                if expires <= now
+            ]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# Sessions in a SQLite file, shared by every worker process that opens it.
+# Data is serialized the way Flask serializes the cookie session.
+class SQLiteSessions(object):
+    PRAGMAS = {
+        'busy_timeout': 1000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+    }
+
+    def __init__(self, path, size=5, timeout=10.0):
+        self.serializer = TaggedJSONSerializer()
+        self._pool = ConnectionPool(
+            lambda: connect(path, self.PRAGMAS), size, timeout
+        )
+        db = self._pool.connection()
+        try:
+            db.executescript(
+                'CREATE TABLE IF NOT EXISTS session ('
+                '  id TEXT PRIMARY KEY, data TEXT NOT NULL,'
+                '  expires REAL NOT NULL'
+                ') WITHOUT ROWID;'
+                # For the sweeper.
+                'CREATE INDEX IF NOT EXISTS session_expires'
+                '  ON session (expires);'
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def load(self, sid, now):
+        db = self._pool.connection()
+        try:
+            row = db.execute(
+                'SELECT expires, data FROM session'
+                ' WHERE id = ? AND expires > ?',
+                (sid, now)
+            ).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return row[0], self.serializer.loads(row[1])
+
+    def save(self, sid, data, expires):
+        self._write(
+            'INSERT OR REPLACE INTO session (id, data, expires)'
+            ' VALUES (?, ?, ?)',
+            (sid, self.serializer.dumps(dict(data)), expires)
+        )
+
+    def delete(self, sid):
+        self._write('DELETE FROM session WHERE id = ?', (sid,))
+
+    def sweep(self, now):
+        return self._write('DELETE FROM session WHERE expires <= ?', (now,))
+
+    # Run one statement in its own transaction, returning its rowcount.
+    def _write(self, sql, params):
+        db = self._pool.connection()
+        try:
+            count = db.execute(sql, params).rowcount
+            db.commit()
+        finally:
+            db.close()
+        return count
+
+    def close(self):
+        self._pool.close()
+
+    def __len__(self):
+        db = self._pool.connection()
+        try:
+            return db.execute('SELECT COUNT(*) FROM session').fetchone()[0]
+        finally:
+            db.close()
+
+
+# Deletes expired sessions from a store every `interval` seconds, on a
+# background thread. interval=None never sweeps. Any store with a
+# sweep(now) will do - ratelimit.py uses it for its buckets too.
+class Sweeper(object):
+    def __init__(self, store, interval, name='session-sweeper'):
+        self.store = store
+        self.interval = interval
+        self.name = name
+        self.swept = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # Start the thread, unless it is running already. Threads do not
+    # survive a fork, so a worker process starts its own on first use.
+    def start(self):
+        if self.interval is None or (
+                self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.swept += self.store.sweep(time.time())
+            except Exception:
+                logger.exception('%s failed.', self.name)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+
+def get_session_store(app=None):
+    app = app or current_app
+
+    if 'sessions' not in app.extensions:
+        if app.config['SESSION_STORAGE'] == 'sqlite':
+            store = SQLiteSessions(app.config['SESSION_DATABASE'])
+        else:
+            store = MemorySessions(app.config['SESSION_SIZE'])
+        app.extensions['sessions'] = store
+        app.extensions['session_sweeper'] = Sweeper(
+            store, app.config['SESSION_SWEEP_INTERVAL']
+        )
+
+    app.extensions['session_sweeper'].start()
+    return app.extensions['sessions']
+
+
+# Flask's cookie sessions, or server-side ones, as SESSION_STORAGE says.
+class ServerSessionInterface(SecureCookieSessionInterface):
+    def open_session(self, app, request):
+        if app.config['SESSION_STORAGE'] == 'cookie':
+            return super().open_session(app, request)
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            entry = get_session_store(app).load(sid, time.time())
+            if entry is not None:
+                expires, data = entry
+                return ServerSession(data, sid, expires)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        if not isinstance(session, ServerSession):
+            return super().save_session(app, session, response)
+
+        store = get_session_store(app)
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        sent = session.sid is not None
+        if session.rotated and sent:
+            store.delete(session.sid)
+            session.sid = None
+
+        # An empty session needs no record, nor a cookie.
+        if not session:
+            if session.sid is not None:
+                store.delete(session.sid)
+            if sent:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Saved when it changed, and otherwise only once half its lifetime
+        # has passed - often enough to keep an active visitor logged in,
+        # without a write on every request.
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if session.sid is None or session.modified \
+                or session.expires - now < lifetime / 2:
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(32)
+            session.expires = now + lifetime
+            store.save(session.sid, session, session.expires)
+        elif not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def init_app(app):
+    app.session_interface = ServerSessionInterface()
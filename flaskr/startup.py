@@ -0,0 +1,76 @@
+"""
+Startup profiling and lazy loading.
+create_app times each component it imports and sets up - every app keeps
+the timings in app.extensions['startup'], `flask startup-profile` prints
+them, and STARTUP_PROFILE logs them when the app is created.
+
+Most processes started by the flask command only run a command such as
+init-db or db-upgrade and never serve a page. Those leave out the views,
+their request hooks and the template preloading, and so the imports that
+only the views need. Commands that do need the views (run, routes, shell)
+get the whole app, as does any process when CLI_LOAD_VIEWS is set.
+"""
+
+import contextlib
+import os
+import sys
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+# flask commands that serve or inspect the views.
+WEB_COMMANDS = ('run', 'routes', 'shell')
+
+
+# Whether this process was started by the flask command to run a command
+# that serves no pages.
+def cli_only():
+    if os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+        return False
+    return not any(arg in WEB_COMMANDS for arg in sys.argv[1:])
+
+
+# Time spent on each component of create_app, in the order they ran.
+class StartupProfile(object):
+    def __init__(self):
+        self.started = time.perf_counter()
+        # Wall clock time, for Last-Modified (see blog.conditional).
+        self.started_at = time.time()
+        self.components = {}
+
+    # Time the block - the component's imports and its set-up.
+    @contextlib.contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.components[name] = self.components.get(name, 0) \
+                + time.perf_counter() - start
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+# One line per component, slowest first, with its share of the total.
+def format_profile(startup):
+    total = startup['seconds']
+    lines = [
+        f"{name:<16}{seconds * 1000:>8.1f}ms{seconds / total:>7.0%}"
+        for name, seconds in sorted(
+            startup['components'].items(), key=lambda item: -item[1]
+        )
+    ]
+    mode = 'commands only' if startup['cli_only'] else 'full app'
+    lines.append(f"{'total':<16}{total * 1000:>8.1f}ms ({mode})")
+    return lines
+
+
+@click.command('startup-profile')
+@with_appcontext
+def startup_profile_command():
+    """Show how long each part of creating the app took."""
+    for line in format_profile(current_app.extensions['startup']):
+        click.echo(line)
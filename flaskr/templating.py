@@ -0,0 +1,73 @@
+"""
+Template compilation and preloading.
+Jinja compiles each template to Python the first time it is rendered, so
+the first requests after a deploy or a new worker pay for it. Compiled
+templates are kept in a bytecode cache on disk that all workers share, and
+every template is loaded at startup, so the first request renders from
+memory like any other.
+
+    flask compile-templates     # fill the cache before starting workers
+"""
+
+import os
+import tempfile
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+# Bytecode cache whose files are written to a temporary name and renamed,
+# so a worker starting while another writes never loads half a file.
+class AtomicBytecodeCache(FileSystemBytecodeCache):
+    def dump_bytecode(self, bucket):
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, self._get_cache_filename(bucket))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+# Load every template into the environment's cache, compiling it (or
+# reading it from the bytecode cache). Returns how many were loaded.
+def preload_templates(app):
+    env = app.jinja_env
+    names = env.list_templates(extensions=('html',))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+    """Compile all templates into the bytecode cache."""
+    start = time.perf_counter()
+    count = preload_templates(current_app)
+    elapsed = (time.perf_counter() - start) * 1000
+    click.echo(f'Compiled {count} templates in {elapsed:.1f}ms.')
+
+
+# Must run before anything uses app.jinja_env, which is created with the
+# options set here.
+def init_app(app):
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_options = dict(
+            app.jinja_options, bytecode_cache=AtomicBytecodeCache(directory)
+        )
+    app.cli.add_command(compile_templates_command)
+
+
+# Preload the templates once everything is registered, timing it.
+def warm(app):
+    start = time.perf_counter()
+    count = preload_templates(app) if app.config['TEMPLATE_PRELOAD'] else 0
+    return count, time.perf_counter() - start
@@ -0,0 +1,185 @@
+"""
+Group commit.
+Every write normally takes the SQLite write lock and commits on its own,
+so in a burst the writers queue behind each other for the lock, and each
+pays for its own commit. With GROUP_COMMIT on, writes are handed to a
+single writer thread instead. It collects the writes that arrive within a
+few milliseconds of each other and runs them in one transaction, each in
+its own SAVEPOINT - a write that fails (a duplicate username, say) is
+rolled back alone and its request gets the exception, while the others
+are committed together.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from werkzeug.exceptions import ServiceUnavailable
+
+
+# Raised when a write waited too long for its turn. It was taken off the
+# queue, so nothing was written. Flask turns it into a 503 response with a
+# Retry-After header.
+class WriteTimeout(ServiceUnavailable):
+    description = 'The site is busy, please try again shortly.'
+
+
+class GroupCommitWriter(object):
+    # connect() opens the writer's connection. Writes arriving within
+    # `window` seconds of the first are committed with it, up to
+    # max_batch at a time.
+    def __init__(self, connect, window=0.002, max_batch=64):
+        self._connect = connect
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # Counters for monitoring.
+        self.batches = 0
+        self.writes = 0
+        self.failed = 0
+
+    # Queue fn(db) to run in the next transaction. Returns a Future for
+    # its result, or the exception it or the commit raised.
+    def submit(self, fn):
+        self._start()
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    # Run fn(db) as part of a group commit and wait for the outcome. A write
+    # still queued after `timeout` seconds is cancelled and raises
+    # WriteTimeout. One already running is waited for - it may have been
+    # committed, so it must not be reported as failed.
+    def run(self, fn, timeout=None):
+        future = self.submit(fn)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise WriteTimeout(retry_after=1)
+            return future.result()
+
+    # The thread is started on the first write, again in a forked worker
+    # process, which does not inherit it, and again if it has died. Writes
+    # still queued when a thread died are kept for the new one.
+    def _start(self):
+        if self._running():
+            return
+        with self._lock:
+            if not self._running():
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._queue = queue.Queue()
+                self._thread = threading.Thread(
+                    target=self._run, name='group-commit', daemon=True
+                )
+                self._thread.start()
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid() \
+            and self._thread.is_alive()
+
+    # Wait for a write, then gather the others arriving within the window.
+    def _next_batch(self):
+        job = self._queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get(
+                    timeout=max(deadline - time.monotonic(), 0)
+                )
+            except queue.Empty:
+                break
+            if job is None:
+                # Stop after this batch.
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    # Connects on the first batch. If that fails, the batch fails with the
+    # error and the next batch tries again, so writes never wait on a
+    # thread that is gone.
+    def _run(self):
+        db = None
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                # Drop writes whose requests gave up waiting, and mark the
+                # rest running so they can no longer be cancelled.
+                batch = [
+                    (fn, future) for fn, future in batch
+                    if future.set_running_or_notify_cancel()
+                ]
+                if not batch:
+                    continue
+                if db is None:
+                    try:
+                        db = self._connect()
+                    except Exception as e:
+                        self._fail(batch, e)
+                        continue
+                self._commit(db, batch)
+        finally:
+            if db is not None:
+                db.close()
+
+    def _fail(self, batch, error):
+        for fn, future in batch:
+            future.set_exception(error)
+        self.failed += len(batch)
+
+    def _commit(self, db, batch):
+        results = []
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for fn, future in batch:
+                db.execute('SAVEPOINT write')
+                try:
+                    results.append((future, fn(db), None))
+                except Exception as e:
+                    db.execute('ROLLBACK TO write')
+                    results.append((future, None, e))
+                db.execute('RELEASE write')
+            db.commit()
+        except Exception as e:
+            # Nothing was committed - every write in the batch fails.
+            if db.in_transaction:
+                db.rollback()
+            self._fail(batch, e)
+            return
+
+        self.batches += 1
+        for future, result, error in results:
+            if error is None:
+                self.writes += 1
+                future.set_result(result)
+            else:
+                self.failed += 1
+                future.set_exception(error)
+
+    # Finish the queued writes and stop the thread.
+    def close(self):
+        if self._running():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'writes': self.writes,
+            'failed': self.failed,
+            'queued': self._queue.qsize(),
+        }
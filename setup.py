@@ -18,4 +18,10 @@ setup(
     install_requires=[
         'flask',
     ],
+    # Optional extras - pip install flaskr[json] for faster JSON in the
+    # API, flaskr[brotli] for brotli compressed responses.
+    extras_require={
+        'json': ['orjson>=3'],
+        'brotli': ['brotli'],
+    },
 )
@@ -12,7 +12,7 @@ import tempfile
 
 import pytest
 from flaskr import create_app
-from flaskr.db import get_db, init_db
+from flaskr.db import get_db, get_pool, init_db
 
 # Read the SQL file.
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
@@ -20,15 +20,21 @@ with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
 
 # Define a fixture (setup function) for a test.
 @pytest.fixture
-def app():
+def app(tmp_path):
     # Create and open temp file, returning the descriptor and path.
     db_fd, db_path = tempfile.mkstemp()
 
-    # Overwrite the actual db path with the test one.
+    # Overwrite the actual db path with the test one, and keep the files the
+    # app writes next to it in the instance folder out of there too.
+    instance = tmp_path / 'instance'
+    instance.mkdir()
     app = create_app({
         # Tells Flask the app is in test mode.
         'TESTING': True,
         'DATABASE': db_path,
+        'SLOW_QUERY_LOG': str(instance / 'slow_queries.log'),
+        'QUERY_STATS_DIR': str(instance / 'query_stats'),
+        'TEMPLATE_CACHE_DIR': str(instance / 'jinja_cache'),
     })
 
     # Connect to the temp db file, not the actual one.
@@ -39,9 +45,16 @@ def app():
     # Return the app as a generator.
     yield app
 
+    # Close the pooled connections, which also removes the WAL files.
+    get_pool(app).close()
+
     # Close the connection and link to the temp db file.
     os.close(db_fd)
     os.unlink(db_path)
+    # Tests that hold on to a connection can leave the WAL files behind.
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.unlink(db_path + suffix)
 
 # Calls app.test_client() withb the application object created by
 # the app fixture (above). Tests will use the client to make requests
@@ -0,0 +1,114 @@
+"""
+Test the JSON API - listing with cursors and field selection, and the
+same login and author checks as the HTML views.
+"""
+
+import pytest
+from flaskr.db import get_db
+
+
+def add_posts(app, count):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            ' VALUES (?, ?, 1, ?)',
+            [(f'post {n}', 'body', f'2018-01-02 00:00:{n:02}')
+             for n in range(count)]
+        )
+        db.commit()
+
+
+def test_list(client):
+    data = client.get('/api/posts').get_json()
+    assert data == {
+        'posts': [{
+            'id': 1, 'title': 'test title', 'body': 'test\nbody',
+            'created': '2018-01-01T00:00:00', 'author_id': 1,
+            'username': 'test', 'revision': 0,
+        }],
+        'next': None,
+    }
+
+
+def test_list_pages(app, client):
+    add_posts(app, 4)
+    response = client.get('/api/posts?limit=2&fields=id,title')
+    assert response.is_streamed
+    data = response.get_json()
+    assert data['posts'] == [
+        {'id': 5, 'title': 'post 3'}, {'id': 4, 'title': 'post 2'}
+    ]
+
+    data = client.get(
+        '/api/posts', query_string={'limit': 2, 'before': data['next']}
+    ).get_json()
+    assert [post['id'] for post in data['posts']] == [3, 2]
+
+    data = client.get(
+        '/api/posts', query_string={'limit': 2, 'before': data['next']}
+    ).get_json()
+    assert [post['id'] for post in data['posts']] == [1]
+    assert data['next'] is None
+
+
+@pytest.mark.parametrize('query', (
+    'fields=id,password', 'limit=0', 'limit=100000', 'before=nonsense',
+))
+def test_list_bad_request(client, query):
+    response = client.get(f'/api/posts?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_get(client):
+    assert client.get('/api/posts/1?fields=title').get_json() == {
+        'title': 'test title'
+    }
+    response = client.get('/api/posts/2')
+    assert response.status_code == 404
+    assert response.get_json() == {'error': "Post id 2 doesn't exist."}
+
+
+def test_write_requires_login(client):
+    assert client.post('/api/posts', json={'title': 'x'}).status_code == 401
+    assert client.put('/api/posts/1', json={'title': 'x'}).status_code == 401
+    assert client.delete('/api/posts/1').status_code == 401
+
+
+def test_create_update_delete(app, client, auth):
+    auth.login()
+    response = client.post('/api/posts', json={'title': 'new', 'body': 'b'})
+    assert response.status_code == 201
+    assert response.headers['Location'].endswith('/api/posts/2')
+    assert response.get_json()['username'] == 'test'
+    # The HTML pages see it straight away.
+    assert b'new' in client.get('/').data
+
+    response = client.put('/api/posts/2', json={'title': 'changed'})
+    assert response.get_json()['title'] == 'changed'
+    assert response.get_json()['revision'] == 1
+
+    assert client.delete('/api/posts/2').status_code == 204
+    assert client.get('/api/posts/2').status_code == 404
+
+
+@pytest.mark.parametrize(('kwargs', 'status'), (
+    ({'json': {'body': 'no title'}}, 400),
+    ({'json': ['not', 'an', 'object']}, 400),
+    ({'data': {'title': 'form'}}, 415),
+))
+def test_create_validate(client, auth, kwargs, status):
+    auth.login()
+    assert client.post('/api/posts', **kwargs).status_code == status
+
+
+def test_author_required(app, client, auth):
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE post SET author_id = 2 WHERE id = 1')
+        db.commit()
+
+    auth.login()
+    assert client.put('/api/posts/1', json={'title': 'x'}).status_code == 403
+    assert client.delete('/api/posts/1').status_code == 403
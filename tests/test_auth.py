@@ -4,9 +4,12 @@ login URL on POST, and the user's data should be in the database.
 We will need to check the error messages shown with invalid data.
 """
 
+import threading
+
 import pytest
 from flask import g, session
 from flaskr.db import get_db
+from flaskr.hashing import PasswordHasher, get_hasher
 
 # This function will test get and post methods for the register function.
 # Passing in the client and test app.
@@ -94,3 +97,72 @@ def test_logout(client, auth):
         auth.logout()
         # Assert the user is not in the session.
         assert 'user_id' not in session
+
+# The test user's hash uses 50000 iterations, less than the configured
+# method, so logging in replaces it with a hash of the new cost.
+def test_login_rehash(app, auth):
+    with app.app_context():
+        old = get_db().execute(
+            "SELECT password FROM user WHERE username = 'test'"
+        ).fetchone()[0]
+
+    auth.login()
+
+    with app.app_context():
+        new = get_db().execute(
+            "SELECT password FROM user WHERE username = 'test'"
+        ).fetchone()[0]
+    assert new != old
+    assert new.startswith(app.config['PASSWORD_HASH_METHOD'] + '$')
+
+    # The new hash still logs in, and is left alone this time.
+    auth.logout()
+    assert auth.login().headers['Location'] == 'http://localhost/'
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT password FROM user WHERE username = 'test'"
+        ).fetchone()[0] == new
+
+# A method without its cost still matches the hashes it makes.
+@pytest.mark.parametrize(
+    'method', ('pbkdf2:sha256', 'pbkdf2:sha256:1000', 'sha256')
+)
+def test_needs_rehash(method):
+    hasher = PasswordHasher(method, workers=0)
+    assert not hasher.needs_rehash(hasher.hash('secret'))
+    assert hasher.needs_rehash(
+        PasswordHasher('pbkdf2:sha1:1000', workers=0).hash('secret')
+    )
+
+# Hashing on the request thread works the same as in worker processes.
+def test_hash_inline(app, client):
+    app.config['PASSWORD_HASH_WORKERS'] = 0
+    client.post('/auth/register', data={'username': 'a', 'password': 'a'})
+    response = client.post(
+        '/auth/login', data={'username': 'a', 'password': 'a'}
+    )
+    assert response.headers['Location'] == 'http://localhost/'
+    with app.app_context():
+        assert get_hasher().stats()['workers'] == 0
+
+# With the hashing queue full, logins are turned away with 503 straight away.
+@pytest.mark.parametrize('path', ('/auth/login', '/auth/register'))
+def test_hash_overloaded(app, client, path):
+    app.config['PASSWORD_HASH_QUEUE'] = 0
+    response = client.post(path, data={'username': 'test', 'password': 'x'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+# Hashes from many request threads at once are all counted.
+def test_hash_counted():
+    hasher = PasswordHasher('pbkdf2:sha256:1', workers=0, max_pending=64)
+    threads = [
+        threading.Thread(target=hasher.hash, args=('secret',))
+        for _ in range(32)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert hasher.stats()['completed'] == 32
+    assert hasher.stats()['rejected'] == 0
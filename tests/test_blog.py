@@ -4,7 +4,9 @@ authentification tests.
 """
 
 import pytest
-from flaskr.db import get_db
+from flaskr import create_app
+from flaskr.cache import get_cache
+from flaskr.db import get_db, get_pool
 
 # Test the index page, passing in the test client and the test login.
 def test_index(client, auth):
@@ -130,3 +132,332 @@ def test_delete(client, auth, app):
         post = db.execute('SELECT * FROM post WHERE id = 1').fetchone()
         # Check no post was returned.
         assert post is None
+
+# Check the index is split into pages that link to each other by cursor.
+def test_index_pagination(app, client):
+    # Add enough posts for three pages of two, some sharing a timestamp so
+    # the id tie-break is exercised.
+    app.config['POSTS_PER_PAGE'] = 2
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            ' VALUES (?, ?, 1, ?)',
+            [(f'post {n}', '', '2018-01-02 00:00:00') for n in range(2, 5)]
+            + [('post 5', '', '2018-01-03 00:00:00')]
+        )
+        db.commit()
+
+    # First page has the newest posts and only an older link.
+    response = client.get('/')
+    assert b'post 5' in response.data
+    assert b'post 4' in response.data
+    assert b'post 3' not in response.data
+    assert b'Newer' not in response.data
+    assert b'?before=2018-01-02+00%3A00%3A00~4' in response.data
+
+    # Second page continues where the first stopped.
+    response = client.get('/?before=2018-01-02 00:00:00~4')
+    assert b'post 3' in response.data
+    assert b'post 2' in response.data
+    assert b'post 4' not in response.data
+    assert b'?after=2018-01-02+00%3A00%3A00~3' in response.data
+
+    # Last page holds the original test post and no older link.
+    response = client.get('/?before=2018-01-02 00:00:00~2')
+    assert b'test title' in response.data
+    assert b'Older' not in response.data
+
+    # Paging back to newer posts gives the same page as going forwards.
+    response = client.get('/?after=2018-01-02 00:00:00~3')
+    assert b'post 5' in response.data
+    assert b'post 4' in response.data
+    assert b'Newer' not in response.data
+
+
+# A malformed cursor is rejected rather than silently ignored.
+def test_index_bad_cursor(client):
+    assert client.get('/?before=nonsense').status_code == 400
+
+
+# Logged out visitors get the cached index page until a post is written.
+def test_index_page_cache(app, client, auth):
+    assert b'test title' in client.get('/').data
+    assert b'test title' in client.get('/').data
+    with app.app_context():
+        assert get_cache('PAGE').stats()['hits'] == 1
+
+    # A write made elsewhere (e.g. another worker) changes the posts version,
+    # so the cached page is not used any more.
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "UPDATE post SET title = 'elsewhere', revision = revision + 1"
+            " WHERE id = 1"
+        )
+        db.commit()
+    assert b'elsewhere' in client.get('/').data
+
+    # Writing through the blog clears the cached pages.
+    auth.login()
+    client.post('/create', data={'title': 'created', 'body': ''})
+    auth.logout()
+    with app.app_context():
+        assert len(get_cache('PAGE')) == 0
+    assert b'created' in client.get('/').data
+
+
+# Post fragments are reused between pages and re-rendered after an update.
+def test_post_fragment_cache(app, client, auth):
+    auth.login()
+    client.get('/')
+    client.get('/')
+    with app.app_context():
+        stats = get_cache('FRAGMENT').stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    response = client.get('/')
+    assert b'updated' in response.data
+    assert b'test title' not in response.data
+
+
+# The index answers conditional requests with 304 until a post changes.
+def test_index_conditional_get(client, auth):
+    response = client.get('/')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    # Logged in users see a different page, so they get a different tag.
+    auth.login()
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    # Any write changes the tag.
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_index_if_modified_since(client):
+    last_modified = client.get('/').headers['Last-Modified']
+    response = client.get('/', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+    response = client.get(
+        '/', headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}
+    )
+    assert response.status_code == 200
+
+
+# Another app on the same database and files, as after a restart.
+def restart(app):
+    return create_app(dict(
+        {'TESTING': True},
+        **{key: app.config[key] for key in (
+            'DATABASE', 'SLOW_QUERY_LOG', 'QUERY_STATS_DIR',
+            'TEMPLATE_CACHE_DIR',
+        )}
+    ))
+
+
+# A new build - or any restart - may render the same posts differently, so
+# the old tag no longer matches, and the page is no older than the app.
+def test_index_new_build(app, client):
+    response = client.get('/')
+    etag = response.headers['ETag']
+    assert response.last_modified.timestamp() \
+        == int(app.extensions['startup']['started_at'])
+
+    restarted = restart(app)
+    try:
+        response = restarted.test_client().get(
+            '/', headers={'If-None-Match': etag}
+        )
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    finally:
+        get_pool(restarted).close()
+
+
+# Search finds posts through the full-text index and marks the matches.
+def test_search(app, client, auth):
+    auth.login()
+    client.post(
+        '/create', data={'title': 'flask tips', 'body': 'use <b>blueprints</b>'}
+    )
+    client.post('/create', data={'title': 'other', 'body': 'nothing here'})
+
+    response = client.get('/search?q=blueprints')
+    assert b'flask tips' in response.data
+    # The body is escaped, only the match is wrapped in <mark>.
+    assert b'&lt;b&gt;<mark>blueprints</mark>&lt;/b&gt;' in response.data
+    assert b'nothing here' not in response.data
+
+    # Updated and deleted posts are kept in step by the triggers.
+    client.post('/2/update', data={'title': 'flask tips', 'body': 'use views'})
+    assert b'flask tips' not in client.get('/search?q=blueprints').data
+    client.post('/2/delete')
+    assert b'flask tips' not in client.get('/search?q=views').data
+
+
+# Characters with a meaning in FTS5 queries are searched for literally.
+@pytest.mark.parametrize(
+    'q', ('"', 'AND', 'NEAR(', 'test*', 'a:b', '\x00', '\x01 \x7f')
+)
+def test_search_query_syntax(client, q):
+    assert client.get('/search', query_string={'q': q}).status_code == 200
+
+
+# Control characters are dropped, and a query FTS5 still refuses is a 400.
+def test_search_control_characters(client, monkeypatch):
+    response = client.get('/search', query_string={'q': 'te\x00st'})
+    assert b'<mark>test</mark> title' in response.data
+
+    monkeypatch.setattr('flaskr.blog.make_search_query', lambda q: '"')
+    assert client.get('/search?q=test').status_code == 400
+
+
+def test_search_pages(app, client):
+    app.config['SEARCH_RESULTS_PER_PAGE'] = 1
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO post (title, body, author_id) VALUES ('test two', '', 1)"
+        )
+        db.commit()
+
+    response = client.get('/search?q=test')
+    assert b'More results' in response.data
+    response = client.get('/search?q=test&page=2')
+    assert b'Better matches' in response.data
+    assert b'More results' not in response.data
+    assert client.get('/search?q=test&page=0').status_code == 400
+
+# In the read-optimized mode the pages read the username from the post.
+def test_denormalized_author(app, client, auth):
+    app.config['DENORMALIZED_AUTHOR'] = True
+    auth.login()
+    client.post('/create', data={'title': 'created', 'body': ''})
+
+    response = client.get('/')
+    assert b'by test on 2018-01-01' in response.data
+    assert b'created' in response.data
+    assert b'by test on' in client.get('/search?q=created').data
+    assert client.get('/1/update').status_code == 200
+
+    with app.app_context():
+        db = get_db()
+        # The test data post was inserted without a username, the trigger
+        # filled it in; changing the author updates it too.
+        db.execute('UPDATE post SET author_id = 2 WHERE id = 1')
+        db.commit()
+        assert db.execute(
+            'SELECT author_username FROM post WHERE id = 1'
+        ).fetchone()[0] == 'other'
+    assert b'by other on 2018-01-01' in client.get('/').data
+
+
+# An author's page lists only their posts, a page at a time, with a count
+# kept up to date as posts are created, moved and deleted.
+def test_author(app, client, auth):
+    app.config['POSTS_PER_PAGE'] = 2
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created)'
+            ' VALUES (?, ?, ?, ?)',
+            [(f'post {n}', '', 2 - n % 2, f'2018-01-0{n} 00:00:00')
+             for n in range(2, 7)]
+        )
+        db.commit()
+
+    # test wrote the first post and posts 3 and 5.
+    response = client.get('/user/test')
+    assert b'Posts by test' in response.data
+    assert b'3 posts' in response.data
+    assert b'post 5' in response.data
+    assert b'post 3' in response.data
+    assert b'post 4' not in response.data
+    assert b'/user/test?before=2018-01-03+00%3A00%3A00~3' in response.data
+
+    response = client.get('/user/test?before=2018-01-03 00:00:00~3')
+    assert b'test title' in response.data
+    assert b'post 5' not in response.data
+    assert b'Older' not in response.data
+
+    auth.login()
+    client.post('/create', data={'title': 'created', 'body': ''})
+    client.post('/1/delete')
+    response = client.get('/user/test')
+    assert b'3 posts' in response.data
+    assert b'created' in response.data
+    assert b'href="/user/test"' in response.data
+
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE post SET author_id = 2 WHERE title = ?', ('created',))
+        db.commit()
+        assert [row[0] for row in db.execute(
+            'SELECT post_count FROM user ORDER BY id'
+        )] == [2, 4]
+
+
+def test_author_missing(client):
+    assert client.get('/user/nobody').status_code == 404
+
+
+# The post page is cached by browsers, proxies and the app until the post
+# is updated, which changes its ETag.
+def test_detail(app, client, auth):
+    response = client.get('/1')
+    assert b'test title' in response.data
+    assert b'href="/1"' in client.get('/').data
+    assert response.cache_control.public
+    assert response.cache_control.max_age == app.config['POST_MAX_AGE']
+    etag = response.headers['ETag']
+
+    assert client.get('/1', headers={'If-None-Match': etag}).status_code \
+        == 304
+    with app.app_context():
+        assert len(get_cache('POST', app)) == 1
+
+    # Changed behind the app's back without a new revision - still cached.
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'sneaky' WHERE id = 1")
+        db.commit()
+    assert b'test title' in client.get('/1').data
+
+    auth.login()
+    response = client.get('/1')
+    assert response.cache_control.private
+    assert b'href="/1/update"' in response.data
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+
+    client.get('/auth/logout')
+    response = client.get('/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'updated' in response.data
+    assert response.headers['ETag'] != etag
+
+    # A new build gives a new tag for the same revision.
+    etag = response.headers['ETag']
+    restarted = restart(app)
+    try:
+        response = restarted.test_client().get(
+            '/1', headers={'If-None-Match': etag}
+        )
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    finally:
+        get_pool(restarted).close()
+
+    assert client.get('/2').status_code == 404
@@ -0,0 +1,132 @@
+"""
+Testing the bulk import and export commands.
+"""
+
+import json
+
+import pytest
+from flaskr.db import get_db, init_db
+
+
+def test_export_posts_jsonl(runner, tmp_path):
+    result = runner.invoke(args=['export-posts', str(tmp_path / 'posts')])
+    assert 'Exported 1 post rows.' in result.output
+    lines = (tmp_path / 'posts').read_text().splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert rows == [{
+        'id': 1, 'author_id': 1, 'created': '2018-01-01 00:00:00',
+        'title': 'test title', 'body': 'test\nbody',
+    }]
+
+
+def test_export_users_csv(runner, tmp_path):
+    runner.invoke(
+        args=['export-users', str(tmp_path / 'users'), '--format', 'csv']
+    )
+    lines = (tmp_path / 'users').read_text().splitlines()
+    assert lines[0] == 'id,username,password'
+    assert lines[1].startswith('1,test,pbkdf2:sha256:50000$')
+    assert len(lines) == 3
+
+
+# Export everything, wipe the database, and import it back again.
+@pytest.mark.parametrize('format', ('jsonl', 'csv'))
+@pytest.mark.parametrize('defer', (False, True))
+def test_round_trip(app, runner, tmp_path, format, defer):
+    users = tmp_path / f'users.{format}'
+    posts = tmp_path / f'posts.{format}'
+    runner.invoke(args=['export-users', str(users), '--format', format])
+    runner.invoke(args=['export-posts', str(posts), '--format', format])
+
+    with app.app_context():
+        init_db()
+
+    args = ['--format', format, '--batch-size', '1']
+    if defer:
+        args.append('--defer-indexes')
+    result = runner.invoke(args=['import-users', str(users)] + args)
+    assert result.exit_code == 0
+    assert 'Imported 2 user rows.' in result.output
+    result = runner.invoke(args=['import-posts', str(posts)] + args)
+    assert result.exit_code == 0
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute('SELECT * FROM post').fetchone()
+        assert post['title'] == 'test title'
+        assert post['body'] == 'test\nbody'
+        # Indexes and the search index are back after a deferred load.
+        assert db.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'post_created_id'"
+        ).fetchone()[0] == 1
+        assert db.execute(
+            "SELECT COUNT(*) FROM post_fts WHERE post_fts MATCH 'body'"
+        ).fetchone()[0] == 1
+
+
+# Rows without an id or created date get them from SQLite.
+def test_import_defaults(app, runner, tmp_path):
+    posts = tmp_path / 'posts.jsonl'
+    posts.write_text('{"author_id": 2, "title": "new", "body": "b"}\n')
+
+    runner.invoke(args=['import-posts', str(posts)])
+
+    with app.app_context():
+        post = get_db().execute(
+            "SELECT * FROM post WHERE title = 'new'"
+        ).fetchone()
+        assert post['id'] == 2
+        assert post['created'] is not None
+
+
+# A bad row rolls the whole import back, dropped indexes included.
+def test_import_rolls_back(app, runner, tmp_path):
+    users = tmp_path / 'users.jsonl'
+    users.write_text(
+        '{"username": "new", "password": "x"}\n'
+        '{"username": "test", "password": "x"}\n'
+    )
+
+    result = runner.invoke(args=['import-users', str(users), '--defer-indexes'])
+    assert result.exit_code != 0
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM user').fetchone()[0] == 2
+        assert db.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'"
+            " AND tbl_name = 'user'"
+        ).fetchone()[0] == 1
+
+
+# Dates are stored the way SQLite writes them, and a bad one stops the
+# import before anything is written.
+def test_import_created(app, runner, client, tmp_path):
+    posts = tmp_path / 'posts.jsonl'
+    posts.write_text(
+        '{"author_id": 1, "title": "zulu", "body": "b",'
+        ' "created": "2018-01-02T00:00:00Z"}\n'
+        '{"author_id": 1, "title": "offset", "body": "b",'
+        ' "created": "2018-01-02T03:04:05+02:00"}\n'
+    )
+    result = runner.invoke(args=['import-posts', str(posts)])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        assert [row[0] for row in get_db().execute(
+            "SELECT CAST(created AS TEXT) FROM post WHERE id > 1 ORDER BY id"
+        )] == ['2018-01-02 00:00:00', '2018-01-02 01:04:05']
+    assert client.get('/').status_code == 200
+    assert client.get('/api/posts').status_code == 200
+
+    posts.write_text(
+        '{"author_id": 1, "title": "fine", "body": "b"}\n'
+        '{"author_id": 1, "title": "bad", "body": "b", "created": "soon"}\n'
+    )
+    result = runner.invoke(args=['import-posts', str(posts)])
+    assert result.exit_code != 0
+    assert 'Record 2' in result.output
+    with app.app_context():
+        assert get_db().execute(
+            'SELECT COUNT(*) FROM post'
+        ).fetchone()[0] == 3
@@ -0,0 +1,74 @@
+"""
+Testing the in-process LRU cache and the logged in user cache built on it.
+"""
+
+from flaskr.auth import forget_user
+from flaskr.cache import LRUCache, cache_stats, get_cache
+
+
+# Least recently used entries are evicted first once the cache is full.
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # Reading 'a' makes 'b' the oldest entry.
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+# Entries older than the TTL count as misses.
+def test_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('flaskr.cache.time.monotonic', lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.set('a', 1)
+
+    now[0] = 105.0
+    assert cache.get('a') == 1
+    now[0] = 111.0
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+# A size of 0 turns the cache off.
+def test_disabled():
+    cache = LRUCache(maxsize=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_stats():
+    cache = LRUCache()
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('b')
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+# After the first request, the logged in user comes from the cache.
+def test_user_cache(app, client, auth):
+    auth.login()
+    client.get('/')
+    client.get('/')
+
+    stats = cache_stats(app)['USER']
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+
+
+# Forgetting a user makes the next request read the row again.
+def test_forget_user(app, client, auth):
+    auth.login()
+    client.get('/')
+
+    with app.app_context():
+        forget_user(1)
+        assert get_cache('USER').get(1) is None
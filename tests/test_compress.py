@@ -0,0 +1,74 @@
+"""
+Test response compression and the fingerprinted static files.
+"""
+
+import gzip
+import json
+import shutil
+
+from flaskr import assets
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+def test_compressed_page(client):
+    plain = client.get('/')
+    assert 'Content-Encoding' not in plain.headers
+
+    response = client.get('/', headers=GZIP)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.data) == plain.data
+    assert len(response.data) < len(plain.data)
+
+    # The ETag turns weak but still matches.
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get(
+        '/', headers=dict(GZIP, **{'If-None-Match': etag})
+    ).status_code == 304
+
+
+def test_small_response_not_compressed(client):
+    response = client.get('/hello', headers=GZIP)
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_compressed_stream(client):
+    response = client.get('/api/posts', headers=GZIP)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    data = json.loads(gzip.decompress(response.data))
+    assert data['posts'][0]['title'] == 'test title'
+
+
+def test_build_static(app, tmp_path):
+    static = tmp_path / 'static'
+    shutil.copytree(app.static_folder, static)
+    manifest = assets.build(str(static))
+    entry = manifest['style.css']
+    assert entry['path'].startswith('dist/style.')
+    assert entry['encodings'] == (
+        ['br', 'gzip'] if assets.brotli else ['gzip']
+    )
+    # The same contents always build to the same name.
+    assert assets.build(str(static)) == manifest
+
+    app.static_folder = str(static)
+    assets.init_app(app)
+    client = app.test_client()
+    page = client.get('/').data
+    assert f'/static/{entry["path"]}'.encode() in page
+
+    response = client.get(f'/static/{entry["path"]}', headers=GZIP)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == app.config['STATIC_MAX_AGE']
+    original = (static / 'style.css').read_bytes()
+    assert gzip.decompress(response.data) == original
+    response.close()
+
+    response = client.get(f'/static/{entry["path"]}')
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == original
+    response.close()
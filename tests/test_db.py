@@ -8,7 +8,8 @@ import sqlite3
 
 # Import the testing module and the get_db function.
 import pytest
-from flaskr.db import get_db
+from flaskr.db import get_db, get_pool, pool_stats
+from flaskr.pool import PoolTimeout
 
 
 # Create function to test getting the db and closing the connection.
@@ -59,3 +60,125 @@ def test_init_db_command(runner, monkeypatch):
     assert 'Initialized' in result.output
     # Asset that the function init_db has been called.
     assert Recorder.called
+
+
+# The connection behind get_db is reused by the next app context instead of
+# being opened again.
+def test_pool_reuses_connection(app):
+    with app.app_context():
+        first = get_db()._conn
+
+    with app.app_context():
+        assert get_db()._conn is first
+
+    stats = pool_stats(app)
+    assert stats['hits'] >= 1
+    assert stats['in_use'] == 0
+
+
+# A full pool makes the next request wait, and give up after the timeout.
+def test_pool_bounded(app):
+    app.config['DATABASE_POOL_SIZE'] = 1
+    app.config['DATABASE_POOL_TIMEOUT'] = 0.01
+    app.extensions['db_pools'].clear()
+    pool = get_pool(app)
+
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()['waits'] == 1
+    assert pool.stats()['timeouts'] == 1
+
+    # Once it is released the connection can be borrowed again.
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+
+# A broken connection fails the health check and is replaced.
+def test_pool_discards_broken_connection(app):
+    pool = get_pool(app)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.close()
+
+    assert pool.acquire() is not conn
+    assert pool.stats()['discarded'] == 1
+
+
+# Work that was not committed is rolled back before the connection is reused.
+def test_pool_rolls_back(app):
+    with app.app_context():
+        get_db().execute('DELETE FROM post')
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM post').fetchone()[0] == 1
+
+
+# New connections get the pragma profile from the config.
+def test_pragmas(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+        # synchronous=NORMAL is reported as 1.
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1
+
+
+# The db-checkpoint command reports how much of the WAL was copied back.
+@pytest.mark.parametrize('mode', ('passive', 'TRUNCATE'))
+def test_db_checkpoint_command(runner, mode):
+    result = runner.invoke(args=['db-checkpoint', '--mode', mode])
+    assert result.exit_code == 0
+    assert 'WAL pages' in result.output
+
+
+def test_db_checkpoint_bad_mode(runner):
+    result = runner.invoke(args=['db-checkpoint', '--mode', 'sometimes'])
+    assert result.exit_code != 0
+
+
+# The search index can be rebuilt from the posts in bulk.
+def test_rebuild_search_command(app, runner):
+    # Empty the index behind the triggers' back, then rebuild it.
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post_fts (post_fts) VALUES ('delete-all')")
+        db.commit()
+
+    result = runner.invoke(args=['rebuild-search'])
+    assert 'Rebuilt the search index for 1 posts.' in result.output
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT COUNT(*) FROM post_fts WHERE post_fts MATCH 'test'"
+        ).fetchone()[0] == 1
+
+
+# A database from before post.author_username gets the column, triggers
+# and usernames from the denormalize-authors command.
+def test_denormalize_authors_command(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.executescript(
+            'DROP TRIGGER post_insert_author;'
+            'DROP TRIGGER post_update_author;'
+            'ALTER TABLE post DROP COLUMN author_username;'
+        )
+        db.execute(
+            "INSERT INTO post (title, body, author_id) VALUES ('two', '', 2)"
+        )
+        db.commit()
+
+    result = runner.invoke(args=['denormalize-authors', '--batch-size', '1'])
+    assert 'onto 2 posts' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert [row[0] for row in db.execute(
+            'SELECT author_username FROM post ORDER BY id'
+        )] == ['test', 'other']
+        db.execute(
+            "INSERT INTO post (title, body, author_id) VALUES ('three', '', 1)"
+        )
+        assert db.execute(
+            "SELECT author_username FROM post WHERE title = 'three'"
+        ).fetchone()[0] == 'test'
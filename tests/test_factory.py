@@ -22,3 +22,54 @@ def test_hello(client):
     # Check the binary expected response with the test response.
     # Use assert to trigger an error if the results do not match.
     assert response.data == b'Hello, World!'
+
+
+# Every template is compiled into the bytecode cache and loaded at startup.
+def test_templates_preloaded(tmp_path):
+    app = create_app({'TESTING': True, 'TEMPLATE_CACHE_DIR': str(tmp_path)})
+    startup = app.extensions['startup']
+    assert startup['templates'] == len(app.jinja_env.list_templates())
+    assert startup['seconds'] >= startup['template_seconds'] > 0
+    assert len(list(tmp_path.iterdir())) == startup['templates']
+    # Already loaded, so rendering does not load it again.
+    assert 'base.html' in [key[1] for key in app.jinja_env.cache.keys()]
+
+    result = app.test_cli_runner().invoke(args=['compile-templates'])
+    assert f"Compiled {startup['templates']} templates" in result.output
+
+    app = create_app({'TESTING': True, 'TEMPLATE_PRELOAD': False,
+                      'TEMPLATE_CACHE_DIR': None})
+    assert app.extensions['startup']['templates'] == 0
+    assert app.jinja_env.bytecode_cache is None
+
+
+def test_healthz(client):
+    assert client.get('/healthz').data == b'ok'
+
+
+# A process that only runs a flask command leaves out the views.
+def test_cli_only(monkeypatch):
+    monkeypatch.setenv('FLASK_RUN_FROM_CLI', 'true')
+    monkeypatch.setattr('sys.argv', ['flask', 'init-db'])
+    app = create_app({'TESTING': True})
+    startup = app.extensions['startup']
+    assert startup['cli_only']
+    assert startup['templates'] == 0
+    assert 'auth' not in app.blueprints
+    assert 'init-db' in app.cli.commands
+    assert 'db' in startup['components']
+    assert 'blog' not in startup['components']
+
+    result = app.test_cli_runner().invoke(args=['startup-profile'])
+    assert '(commands only)' in result.output
+    assert result.output.splitlines()[0].split()[0] in startup['components']
+
+    # flask routes needs them.
+    monkeypatch.setattr('sys.argv', ['flask', 'routes'])
+    app = create_app({'TESTING': True})
+    assert 'auth' in app.blueprints
+    assert not app.extensions['startup']['cli_only']
+
+    monkeypatch.setattr('sys.argv', ['flask', 'init-db'])
+    app = create_app({'TESTING': True, 'CLI_LOAD_VIEWS': True})
+    assert 'blog' in app.extensions['startup']['components']
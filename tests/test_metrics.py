@@ -0,0 +1,97 @@
+"""
+Testing the metrics registry and the /metrics endpoint.
+"""
+
+import threading
+
+import pytest
+from flaskr.metrics import SHARDS, Counter, Gauge, Histogram, render
+
+
+# Values recorded by different threads are added up at scrape time.
+def test_sharded_counter():
+    counter = Counter('hits_total', 'Hits.', ('page',))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(1, 'home')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert list(counter.samples()) == [('hits_total', (('page', 'home'),), 4000)]
+    with pytest.raises(ValueError):
+        counter.dec()
+
+
+# A thread per request does not add a shard per request.
+def test_shards_bounded():
+    counter = Counter('hits_total', 'Hits.')
+    for _ in range(SHARDS * 3):
+        thread = threading.Thread(target=counter.inc)
+        thread.start()
+        thread.join()
+
+    assert len(counter._shards) == SHARDS
+    assert list(counter.samples()) == [('hits_total', (), SHARDS * 3)]
+
+
+def test_gauge():
+    gauge = Gauge('busy', 'Busy.')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert list(gauge.samples()) == [('busy', (), 1)]
+
+
+# Buckets are reported cumulatively, with the sum and count.
+def test_histogram():
+    histogram = Histogram('latency', 'Latency.', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    text = render([histogram])
+    assert '# TYPE latency histogram' in text
+    assert 'latency_bucket{le="0.1"} 1' in text
+    assert 'latency_bucket{le="1.0"} 3' in text
+    assert 'latency_bucket{le="+Inf"} 4' in text
+    assert 'latency_sum 6.05' in text
+    assert 'latency_count 4' in text
+
+
+def test_label_escaping():
+    counter = Counter('c', 'C.', ('name',))
+    counter.inc(1, 'a "quoted"\nvalue')
+    assert r'c{name="a \"quoted\"\nvalue"} 1' in render([counter])
+
+
+# The endpoint reports what earlier requests did.
+def test_metrics_endpoint(client):
+    client.get('/')
+    client.get('/')
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert ('flaskr_requests_total{endpoint="blog.index",method="GET",'
+            'status="200"} 2') in text
+    assert ('flaskr_request_duration_seconds_count{endpoint="blog.index"} 2'
+            in text)
+    assert 'flaskr_db_duration_seconds_count{endpoint="blog.index"} 2' in text
+    assert ('flaskr_template_render_seconds_count{endpoint="blog.index"} 2'
+            in text)
+    assert 'flaskr_response_size_bytes_bucket{endpoint="blog.index"' in text
+    # The scrape itself is in progress.
+    assert 'flaskr_requests_in_progress 1' in text
+    assert 'flaskr_db_connections{state="in_use"}' in text
+    assert 'flaskr_db_pool_events_total{event="hits"}' in text
+
+
+def test_metrics_disabled():
+    from flaskr import create_app
+    app = create_app({'TESTING': True, 'METRICS_ENABLED': False})
+    assert app.test_client().get('/metrics').status_code == 404
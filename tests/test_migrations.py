@@ -0,0 +1,96 @@
+"""
+Test the schema migrations - a database from schema.sql starts fully
+migrated, and db-upgrade brings an old tutorial database up to date
+without losing its posts.
+"""
+
+from flaskr import migrations
+from flaskr.db import get_db
+
+
+# The tutorial schema, as databases were created before any migrations.
+TUTORIAL_SCHEMA = """
+    DROP TABLE IF EXISTS schema_version;
+    DROP TABLE IF EXISTS post_fts;
+    DROP TABLE IF EXISTS blog_state;
+    DROP TABLE IF EXISTS post;
+    DROP TABLE IF EXISTS user;
+    CREATE TABLE user (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      username TEXT UNIQUE NOT NULL,
+      password TEXT NOT NULL
+    );
+    CREATE TABLE post (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      author_id INTEGER NOT NULL,
+      created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      title TEXT NOT NULL,
+      body TEXT NOT NULL,
+      FOREIGN KEY (author_id) REFERENCES user (id)
+    );
+    INSERT INTO user (username, password) VALUES ('test', 'x'), ('other', 'y');
+    INSERT INTO post (title, body, author_id)
+    VALUES ('test title', 'test body', 1), ('second', 'searchable', 2);
+"""
+
+
+def make_tutorial_database(app):
+    with app.app_context():
+        get_db().executescript(TUTORIAL_SCHEMA)
+
+
+def test_init_db_is_current(runner):
+    result = runner.invoke(args=['db-status'])
+    assert f'version {migrations.LATEST} of {migrations.LATEST}' \
+        in result.output
+    assert 'pending' not in result.output
+
+    result = runner.invoke(args=['db-upgrade'])
+    assert 'up to date' in result.output
+
+
+def test_upgrade_tutorial_database(app, runner):
+    make_tutorial_database(app)
+    result = runner.invoke(args=['db-status'])
+    assert f'version 0 of {migrations.LATEST}' in result.output
+
+    result = runner.invoke(args=['db-upgrade', '--batch-size', '1'])
+    assert f'Applied {migrations.LATEST} ' in result.output
+    assert 'post created index (' in result.output
+    assert 'write lock held to build the index).' in result.output
+    assert 'Analyzed' in result.output
+
+    with app.app_context():
+        db = get_db()
+        names = {row[0] for row in db.execute(
+            'SELECT name FROM sqlite_master'
+        )}
+        assert {'post_created_id', 'post_author_created', 'blog_state',
+                'post_fts', 'post_insert_author', 'sqlite_stat1'} <= names
+        assert [row[0] for row in db.execute(
+            'SELECT author_username FROM post ORDER BY id'
+        )] == ['test', 'other']
+        assert db.execute(
+            "SELECT rowid FROM post_fts WHERE post_fts MATCH 'searchable'"
+        ).fetchone()[0] == 2
+
+    # The upgraded database serves the blog like a new one.
+    assert b'test title' in app.test_client().get('/').data
+    assert b'second' in app.test_client().get('/search?q=searchable').data
+
+
+def test_upgrade_to(app, runner):
+    make_tutorial_database(app)
+    result = runner.invoke(args=['db-upgrade', '--to', '3'])
+    assert 'Applied 3 ' in result.output
+    assert 'Applied 4 ' not in result.output
+
+    result = runner.invoke(args=['db-status'])
+    assert f'version 3 of {migrations.LATEST}' in result.output
+    assert 'pending' in result.output
+
+    with app.app_context():
+        done = migrations.upgrade(get_db())
+    assert [version for version, _, _ in done] == list(
+        range(4, migrations.LATEST + 1)
+    )
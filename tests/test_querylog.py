@@ -0,0 +1,71 @@
+"""
+Testing the query instrumentation: statement totals, the Server-Timing
+header, the slow-query log and the query-stats command.
+"""
+
+import json
+
+from flaskr.db import get_db
+from flaskr.querylog import get_stats, normalize
+
+
+# Statements differing only in their literals are counted together.
+def test_normalize():
+    assert normalize(
+        "SELECT *\n  FROM user WHERE id = 12 AND username = 'it''s'"
+    ) == 'SELECT * FROM user WHERE id = ? AND username = ?'
+    # Digits inside names are left alone.
+    assert normalize('SELECT * FROM post_fts5') == 'SELECT * FROM post_fts5'
+
+
+# Every statement is counted with its rows once the context ends.
+def test_record_queries(app):
+    with app.app_context():
+        db = get_db()
+        db.execute('SELECT * FROM post').fetchall()
+        db.execute('SELECT * FROM post').fetchall()
+        db.execute("UPDATE post SET title = 'x'")
+
+    stats = get_stats(app).snapshot()
+    assert stats['SELECT * FROM post']['count'] == 2
+    assert stats['SELECT * FROM post']['rows'] == 2
+    assert stats['UPDATE post SET title = ?']['rows'] == 1
+
+
+def test_server_timing(client):
+    timing = client.get('/').headers['Server-Timing']
+    assert 'db;dur=' in timing
+    assert 'queries"' in timing
+    assert 'render;dur=' in timing
+    assert 'total;dur=' in timing
+
+
+# With the threshold at 0 every statement is slow, and is logged with its
+# plan but without its parameters.
+def test_slow_query_log(app, client, tmp_path):
+    log = tmp_path / 'slow.log'
+    app.config['SLOW_QUERY_MS'] = 0
+    app.config['SLOW_QUERY_LOG'] = str(log)
+
+    client.get('/')
+
+    entries = [json.loads(line) for line in log.read_text().splitlines()]
+    index = [e for e in entries if 'FROM post p JOIN user' in e['statement']]
+    assert index[0]['path'] == '/'
+    assert any('post_created_id' in step for step in index[0]['plan'])
+
+
+# Totals saved by the workers are added up by the query-stats command.
+def test_query_stats_command(app, client, runner, tmp_path):
+    app.config['QUERY_STATS_DIR'] = str(tmp_path)
+    app.config['QUERY_STATS_FLUSH'] = 0
+
+    client.get('/')
+    assert list(tmp_path.glob('*.json'))
+
+    result = runner.invoke(args=['query-stats', '--sort', 'count'])
+    assert 'FROM blog_state' in result.output
+
+    result = runner.invoke(args=['query-stats', '--reset'])
+    assert 'Deleted' in result.output
+    assert not list(tmp_path.glob('*.json'))
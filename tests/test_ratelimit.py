@@ -0,0 +1,136 @@
+"""
+Test the rate limits on login and register - over the limit is refused
+with 429 before the password is hashed.
+"""
+
+import sqlite3
+import time
+
+import pytest
+from flaskr.ratelimit import MemoryBuckets, SQLiteBuckets, refill_and_take
+
+
+def test_refill_and_take():
+    # A new bucket starts full.
+    assert refill_and_take(None, None, 0, 2, 10) == (1, 0)
+    # Empty, a token comes back every 5 seconds.
+    assert refill_and_take(0, 0, 2.5, 2, 10) == (0.5, 2.5)
+    assert refill_and_take(0, 0, 5, 2, 10) == (0, 0)
+    # Never more than the capacity.
+    assert refill_and_take(0, 0, 1000, 2, 10) == (1, 0)
+
+
+def test_memory_buckets_bounded():
+    buckets = MemoryBuckets(maxsize=2)
+    for key in 'abc':
+        buckets.take(key, 1, 60)
+    assert len(buckets) == 2
+    # 'a' was dropped, so it starts full again.
+    assert buckets.take('a', 1, 60) == 0
+    assert buckets.take('c', 1, 60) > 0
+
+
+def test_login_limited_by_username(app, client, monkeypatch):
+    app.config['RATE_LIMITS'] = {'login_user': (2, 60)}
+
+    for _ in range(2):
+        response = client.post(
+            '/auth/login', data={'username': 'Test', 'password': 'wrong'}
+        )
+        assert response.status_code == 200
+
+    # Refused before the hasher is even asked.
+    def fail(*args):
+        raise AssertionError('Password hashed.')
+    monkeypatch.setattr('flaskr.hashing.PasswordHasher.check', fail)
+    response = client.post(
+        '/auth/login', data={'username': 'test', 'password': 'test'}
+    )
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 30
+    monkeypatch.undo()
+
+    # Other usernames and the login form itself are not limited.
+    assert client.post(
+        '/auth/login', data={'username': 'other', 'password': 'x'}
+    ).status_code == 200
+    assert client.get('/auth/login').status_code == 200
+
+
+def test_register_limited_by_ip(app, client):
+    app.config['RATE_LIMITS'] = {'register_ip': (1, 600)}
+    client.post('/auth/register', data={'username': 'a', 'password': 'a'})
+    response = client.post(
+        '/auth/register', data={'username': 'b', 'password': 'b'}
+    )
+    assert response.status_code == 429
+
+    app.config['RATE_LIMITS'] = {}
+    assert client.post(
+        '/auth/register', data={'username': 'b', 'password': 'b'}
+    ).status_code == 302
+
+
+# Workers sharing the SQLite file share the buckets.
+def test_sqlite_buckets_shared(tmp_path):
+    path = str(tmp_path / 'ratelimit.sqlite')
+    first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+    try:
+        assert first.take('key', 2, 60) == 0
+        assert second.take('key', 2, 60) == 0
+        assert first.take('key', 2, 60) == pytest.approx(30, abs=1)
+        assert second.take('other', 2, 60) == 0
+    finally:
+        first.close()
+        second.close()
+
+
+def test_sqlite_storage(app, client, tmp_path):
+    app.config.update(
+        RATELIMIT_STORAGE='sqlite',
+        RATELIMIT_DATABASE=str(tmp_path / 'ratelimit.sqlite'),
+        RATE_LIMITS={'login_ip': (1, 60)},
+    )
+    client.post('/auth/login', data={'username': 'a', 'password': 'a'})
+    assert client.post(
+        '/auth/login', data={'username': 'a', 'password': 'a'}
+    ).status_code == 429
+    assert isinstance(app.extensions['ratelimit'], SQLiteBuckets)
+    app.extensions['ratelimit_sweeper'].close()
+    app.extensions['ratelimit'].close()
+
+
+# Buckets that have filled up again are deleted, others are kept.
+def test_sqlite_buckets_swept(tmp_path):
+    buckets = SQLiteBuckets(str(tmp_path / 'ratelimit.sqlite'))
+    try:
+        buckets.take('one', 2, 60)
+        buckets.take('two', 1, 600)
+        now = time.time()
+        assert buckets.sweep(now) == 0
+        # One token of two comes back in 30 seconds, one of one in 600.
+        assert buckets.sweep(now + 31) == 1
+        assert len(buckets) == 1
+        assert buckets.take('two', 1, 600) > 0
+        assert buckets.sweep(now + 601) == 1
+        assert len(buckets) == 0
+    finally:
+        buckets.close()
+
+
+# A file from before full_at is replaced rather than failing every take.
+def test_sqlite_buckets_old_file(tmp_path):
+    path = str(tmp_path / 'ratelimit.sqlite')
+    db = sqlite3.connect(path)
+    db.execute(
+        'CREATE TABLE bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)'
+    )
+    db.execute("INSERT INTO bucket VALUES ('key', 0, 0)")
+    db.commit()
+    db.close()
+    buckets = SQLiteBuckets(path)
+    try:
+        assert len(buckets) == 0
+        assert buckets.take('key', 1, 60) == 0
+    finally:
+        buckets.close()
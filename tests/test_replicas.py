@@ -0,0 +1,145 @@
+"""
+Test the read replicas - read-only views are served from the replica copy,
+while a visitor who has just written reads from the primary until the
+replica catches up.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+import pytest
+from flaskr.db import connect, get_db, get_replicas
+from flaskr.replicas import ReplicaSet
+
+
+@pytest.fixture
+def replica(app):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    app.config['DATABASE_REPLICAS'] = [path]
+    # Only the first copy is made on a schedule, the tests sync by hand.
+    app.config['REPLICA_SYNC_INTERVAL'] = None
+    replicas = get_replicas(app)
+    replicas.start()
+    while replicas.syncs == 0:
+        time.sleep(0.01)
+
+    yield replicas
+
+    replicas.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+    for path in (replicas.lock_path, replicas.stamp_path):
+        os.unlink(path)
+
+
+# Change a post behind the app's back, as another worker would.
+def rename_post(app, title):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            'UPDATE post SET title = ?, revision = revision + 1 WHERE id = 1',
+            (title,)
+        )
+        db.commit()
+
+
+def test_no_replicas(app):
+    with app.app_context():
+        assert get_replicas() is None
+
+
+def test_reads_from_replica(app, client, replica):
+    rename_post(app, 'changed title')
+    response = client.get('/')
+    assert b'test title' in response.data
+    assert b'changed title' not in response.data
+    # Searching reads the replica too.
+    assert b'<mark>test</mark> title' in client.get('/search?q=test').data
+
+    replica.sync()
+    response = client.get('/')
+    assert b'changed title' in response.data
+
+
+def test_read_your_writes(app, client, auth, replica):
+    auth.login()
+    client.post('/create', data={'title': 'fresh post', 'body': ''})
+    # The writer sees their post at once, from the primary.
+    assert b'fresh post' in client.get('/').data
+
+    # Everyone else reads the replica, which does not have it yet.
+    other = app.test_client()
+    assert b'fresh post' not in other.get('/').data
+
+    replica.sync()
+    assert b'fresh post' in other.get('/').data
+    assert b'fresh post' in client.get('/').data
+
+
+def test_sync_on_write(app, client, auth, replica):
+    app.config['REPLICA_SYNC_ON_WRITE'] = True
+    syncs = replica.syncs
+    auth.login()
+    client.post('/create', data={'title': 'fresh post', 'body': ''})
+
+    deadline = time.monotonic() + 5
+    while replica.syncs == syncs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert b'fresh post' in app.test_client().get('/').data
+
+
+def test_replica_read_only(replica):
+    db = replica.connection()
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute('DELETE FROM post')
+    finally:
+        db.close()
+
+
+def test_sync_replicas_command(app, runner, replica):
+    rename_post(app, 'changed title')
+    result = runner.invoke(args=['sync-replicas'])
+    assert 'to 1 replicas' in result.output
+    assert b'changed title' in app.test_client().get('/').data
+
+
+# Another worker's sync thread finds the copy already made and skips its
+# own, but still knows when the replicas were synced.
+def test_sync_shared(app, replica):
+    other = ReplicaSet(app.config['DATABASE'], replica.paths, connect)
+    assert other.synced_at == replica.synced_at
+    assert not other.sync(time.time() - 5)
+    assert other.syncs == 0
+
+    assert other.sync()
+    assert other.synced_at > time.time() - 5
+    assert replica.synced_at == other.synced_at
+    assert not replica.sync(other.synced_at)
+    other.close()
+
+
+# Queries sent to the replica are timed like those on the primary.
+def test_replica_queries_timed(client, replica):
+    timing = client.get('/').headers['Server-Timing']
+    assert 'desc="0 queries"' not in timing
+
+
+# A new user is logged in straight after registering, although the replica
+# does not have them yet.
+def test_register_then_login(app, client, replica):
+    client.post('/auth/register', data={'username': 'new', 'password': 'a'})
+    client.post('/auth/login', data={'username': 'new', 'password': 'a'})
+    response = client.get('/')
+    assert b'Log Out' in response.data
+    assert b'new' in response.data
+
+    # Even without the visitor's last write, the user is found.
+    with client.session_transaction() as session:
+        del session['last_write']
+    app.extensions['caches']['USER'].clear()
+    assert b'Log Out' in client.get('/').data
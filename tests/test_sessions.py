@@ -0,0 +1,125 @@
+"""
+Test server-side sessions - the cookie holds only an id, the session
+carries the logged in user, and expired sessions are swept in bulk.
+"""
+
+import time
+
+import pytest
+from flaskr.sessions import (
+    MemorySessions, SQLiteSessions, Sweeper, get_session_store
+)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(app, tmp_path, request):
+    app.config['SESSION_STORAGE'] = request.param
+    app.config['SESSION_DATABASE'] = str(tmp_path / 'sessions.sqlite')
+    yield request.param
+    if 'sessions' in app.extensions:
+        app.extensions['session_sweeper'].close()
+        app.extensions['sessions'].close()
+
+
+def session_id(client):
+    cookie = next(
+        (c for c in client.cookie_jar if c.name == 'session'), None
+    )
+    return None if cookie is None else cookie.value
+
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite'])
+def test_store(tmp_path, store):
+    if store == 'memory':
+        sessions = MemorySessions(maxsize=2)
+    else:
+        sessions = SQLiteSessions(str(tmp_path / 'sessions.sqlite'))
+
+    sessions.save('a', {'user_id': 1, 'pair': (1, 2)}, 100)
+    sessions.save('b', {'user_id': 2}, 200)
+    assert sessions.load('a', 50) == (100, {'user_id': 1, 'pair': (1, 2)})
+    assert sessions.load('a', 100) is None
+    assert sessions.load('missing', 50) is None
+
+    assert sessions.sweep(150) == 1
+    assert len(sessions) == 1
+    sessions.delete('b')
+    assert sessions.load('b', 50) is None
+    sessions.close()
+
+
+def test_memory_store_bounded():
+    sessions = MemorySessions(maxsize=2)
+    for sid in 'abc':
+        sessions.save(sid, {}, 100)
+    assert len(sessions) == 2
+    assert sessions.load('a', 0) is None
+
+
+def test_sweeper():
+    sessions = MemorySessions()
+    sessions.save('old', {}, time.time() - 1)
+    sessions.save('new', {}, time.time() + 60)
+    sweeper = Sweeper(sessions, 0.01)
+    sweeper.start()
+    deadline = time.monotonic() + 5
+    while sweeper.swept == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sweeper.close()
+    assert sweeper.swept == 1
+    assert len(sessions) == 1
+
+
+def test_login(app, client, auth, storage, monkeypatch):
+    # No session until there is something to keep.
+    client.get('/')
+    assert session_id(client) is None
+
+    auth.login()
+    sid = session_id(client)
+    # An opaque id, not the signed session data.
+    assert '.' not in sid and len(sid) > 40
+    assert b'test' in client.get('/').data
+
+    # The user row came with the session - no user query needed.
+    def fail(*args):
+        raise AssertionError('User queried.')
+    monkeypatch.setattr('flaskr.auth.get_read_db', fail)
+    response = client.get('/')
+    assert b'Log Out' in response.data
+    assert 'Cookie' in response.vary
+    # Unchanged, so not saved again.
+    assert 'Set-Cookie' not in response.headers
+    monkeypatch.undo()
+
+    # Logging in again gives a new id and forgets the old one.
+    auth.login()
+    assert session_id(client) != sid
+    assert get_session_store(app).load(sid, time.time()) is None
+
+    auth.logout()
+    assert session_id(client) is None
+    assert len(get_session_store(app)) == 0
+
+
+def test_user_refreshed(app, client, auth, storage):
+    app.config['USER_CACHE_TTL'] = 0
+    auth.login()
+    client.get('/')
+    with client.session_transaction() as session:
+        assert session['user']['username'] == 'test'
+        assert 'password' not in session['user']
+        loaded = session['user_loaded']
+
+    time.sleep(0.01)
+    client.get('/')
+    with client.session_transaction() as session:
+        assert session['user_loaded'] > loaded
+
+
+def test_expired(app, client, auth, storage):
+    app.config['PERMANENT_SESSION_LIFETIME'] = 0.05
+    auth.login()
+    assert b'Log Out' in client.get('/').data
+    time.sleep(0.1)
+    assert b'Log Out' not in client.get('/').data
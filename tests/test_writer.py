@@ -0,0 +1,140 @@
+"""
+Test group commit - concurrent writes share transactions, and a write
+that fails is rolled back alone and reported to its own request.
+"""
+
+import sqlite3
+import threading
+
+import pytest
+from flaskr.db import connect, get_db, get_writer
+from flaskr.writer import GroupCommitWriter, WriteTimeout
+
+
+@pytest.fixture
+def writer(app):
+    app.config['GROUP_COMMIT'] = True
+    # Wide window so the test's threads land in the same batches.
+    app.config['GROUP_COMMIT_WINDOW_MS'] = 50
+    writer = get_writer(app)
+    yield writer
+    writer.close()
+
+
+def insert_user(name):
+    def fn(db):
+        return db.execute(
+            'INSERT INTO user (username, password) VALUES (?, ?)', (name, 'x')
+        ).lastrowid
+    return fn
+
+
+def test_writes_batched(app, writer):
+    barrier = threading.Barrier(8)
+    ids = []
+
+    def worker(n):
+        barrier.wait()
+        ids.append(writer.run(insert_user(f'user{n}')))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(ids) == list(range(3, 11))
+    assert writer.writes == 8
+    assert writer.batches < 8
+    with app.app_context():
+        assert get_db().execute(
+            'SELECT COUNT(*) FROM user'
+        ).fetchone()[0] == 10
+
+
+def test_failed_write_isolated(app, writer):
+    good = writer.submit(insert_user('new'))
+    bad = writer.submit(insert_user('test'))
+    also_good = writer.submit(insert_user('newer'))
+
+    assert good.result() and also_good.result()
+    with pytest.raises(sqlite3.IntegrityError):
+        bad.result()
+    assert writer.failed == 1
+
+    db = connect(app.config['DATABASE'])
+    assert [row[0] for row in db.execute(
+        'SELECT username FROM user ORDER BY id'
+    )] == ['test', 'other', 'new', 'newer']
+    db.close()
+
+
+# A failed connect fails the waiting writes at once, and the next write
+# tries again.
+def test_connect_failure(app):
+    attempts = []
+
+    def connect_once_failing():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError('unable to open database file')
+        return sqlite3.connect(app.config['DATABASE'])
+
+    writer = GroupCommitWriter(connect_once_failing)
+    with pytest.raises(sqlite3.OperationalError):
+        writer.run(insert_user('new'), timeout=5)
+    assert writer.failed == 1
+
+    assert writer.run(insert_user('new'), timeout=5)
+    assert len(attempts) == 2
+    writer.close()
+
+    # A thread that died is started again.
+    writer._thread = threading.Thread(target=lambda: None)
+    writer._thread.start()
+    writer._thread.join()
+    assert writer.run(insert_user('newer'), timeout=5)
+    writer.close()
+
+
+def test_views_use_writer(client, auth, writer):
+    response = client.post(
+        '/auth/register', data={'username': 'test', 'password': 'a'}
+    )
+    assert b'already registered' in response.data
+    assert client.post(
+        '/auth/register', data={'username': 'a', 'password': 'a'}
+    ).headers['Location'].endswith('/auth/login')
+
+    auth.login()
+    client.post('/create', data={'title': 'grouped', 'body': ''})
+    assert b'grouped' in client.get('/').data
+    # The new user, the test user's password rehash on login, and the post.
+    assert writer.writes == 3
+    assert writer.failed == 1
+
+
+# A write that times out in the queue is never run, and its request gets
+# a 503 rather than a 500.
+def test_timeout_cancels(app, writer):
+    started = threading.Event()
+    release = threading.Event()
+
+    def block(db):
+        started.set()
+        release.wait()
+
+    blocker = writer.submit(block)
+    started.wait()
+    with pytest.raises(WriteTimeout) as info:
+        writer.run(insert_user('late'), timeout=0.05)
+    assert info.value.code == 503
+    release.set()
+    blocker.result()
+
+    writer.run(insert_user('after'))
+    db = connect(app.config['DATABASE'])
+    assert [row[0] for row in db.execute(
+        'SELECT username FROM user ORDER BY id'
+    )] == ['test', 'other', 'after']
+    db.close()